@@ -0,0 +1,74 @@
+"""
+Benchmark of `import megazord` and construction of the first Target.
+
+Every sample runs in a fresh interpreter inside an empty temporary directory. The script fails if importing
+megazord leaves any files behind or if the median timings exceed budgets from benchmarks/baseline.json.
+
+    python benchmarks/bench_import.py [--samples N] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+SAMPLE = """
+import time, json
+t0 = time.perf_counter()
+import megazord
+t1 = time.perf_counter()
+target = megazord.Target('main.cpp', output='bin/main')
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'first_target': t2 - t1}))
+"""
+
+IMPORT_ONLY = "import megazord"
+
+
+def run(code, cwd):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env.pop('MEGAZORD_ROOT', None)
+    return subprocess.check_output([sys.executable, '-c', code], cwd=cwd, env=env).decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=15)
+    parser.add_argument('--output', default=None, help='write results as JSON to the file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        run(IMPORT_ONLY, cwd)
+        leftovers = os.listdir(cwd)
+    if leftovers:
+        print("FAIL: import megazord created {}".format(leftovers))
+        sys.exit(1)
+
+    samples = []
+    for _ in range(args.samples):
+        with tempfile.TemporaryDirectory() as cwd:
+            samples.append(json.loads(run(SAMPLE, cwd)))
+    results = {key: statistics.median(sample[key] for sample in samples) * 1000 for key in samples[0]}
+
+    with open(BASELINE) as f:
+        budgets = json.load(f)['import']
+    failed = False
+    for key, value in sorted(results.items()):
+        status = 'ok' if value <= budgets[key] else 'FAIL'
+        failed = failed or status == 'FAIL'
+        print("{:<14} {:8.2f} ms (budget {} ms) {}".format(key, value, budgets[key], status))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'import', 'unit': 'ms', 'results': results}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
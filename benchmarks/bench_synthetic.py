@@ -0,0 +1,202 @@
+"""
+Benchmark of megazord's own overhead on synthetic projects built by a stand-in compiler (fake_cc.py).
+
+A project has N targets with M sources each, linked into one of the graph shapes:
+    chain    every target depends on the previous one
+    diamond  the root depends on N-2 middle targets, all of them depend on the base target
+    fanout   the root depends on N-1 independent targets
+
+For every shape the script measures cold, no-op (without and with the graph snapshot, see megazord.snapshot),
+one-source-touched and header-touched builds (each in a fresh interpreter, including construction of targets) plus
+costs of hashing the graph and of interstate I/O.
+With --workers N objects are compiled by N megazord workers started on localhost (see megazord.remote).
+
+    python benchmarks/bench_synthetic.py --targets 100 --sources 10 --output bench_output.json
+    python benchmarks/bench_synthetic.py --incremental --jobs 4 --sleep 0.05 --workers 3
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_CC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_cc.py')
+SHAPES = ['chain', 'diamond', 'fanout']
+
+
+def edges(shape, count):
+    """
+    :return: dict of dependencies indexes for every target index, target 0 is the root
+    """
+    if shape == 'chain':
+        return {i: [i + 1] if i + 1 < count else [] for i in range(count)}
+    if shape == 'diamond':
+        base = count - 1
+        graph = {i: [base] for i in range(1, base)}
+        graph[0] = list(range(1, base)) or [base]
+        graph[base] = []
+        return graph
+    if shape == 'fanout':
+        graph = {i: [] for i in range(1, count)}
+        graph[0] = list(range(1, count))
+        return graph
+    raise ValueError("Unknown shape {}".format(shape))
+
+
+def generate(path, targets, sources):
+    os.makedirs(os.path.join(path, 'include'))
+    with open(os.path.join(path, 'include', 'common.h'), 'w') as f:
+        f.write('#define COMMON 1\n')
+    for i in range(targets):
+        with open(os.path.join(path, 'include', 't{}.h'.format(i)), 'w') as f:
+            f.write('#include "common.h"\nint t{}();\n'.format(i))
+        os.makedirs(os.path.join(path, 'src', 't{}'.format(i)))
+        for j in range(sources):
+            with open(os.path.join(path, 'src', 't{}'.format(i), 's{}.cpp'.format(j)), 'w') as f:
+                f.write('#include "t{0}.h"\nint f{0}_{1}() {{ return {1}; }}\n'.format(i, j))
+
+
+BUILD = """
+import sys, time, json
+t0 = time.perf_counter()
+import megazord
+megazord.verbose = 0
+shape, count, jobs, incremental, fake_cc = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4] == '1', sys.argv[5]
+sys.path.insert(0, sys.argv[6])
+import os, bench_synthetic
+graph = bench_synthetic.edges(shape, count)
+compiler = megazord.CCompiler(fake_cc)
+if os.environ.get('BENCH_WORKERS'):
+    megazord.remote.enable(os.environ['BENCH_WORKERS'].split(','))
+targets = [megazord.Target('src/t{}/*.cpp'.format(i), output='lib/libt{}.so'.format(i), name='t{}'.format(i),
+                           compiler=compiler).add_include_path('include').set_incremental(incremental, jobs)
+           for i in range(count)]
+for i, dependencies in graph.items():
+    targets[i].depends_on([targets[d] for d in dependencies])
+t1 = time.perf_counter()
+targets[0].assembly(jobs=jobs)
+t2 = time.perf_counter()
+result = {'construct': t1 - t0, 'assembly': t2 - t1, 'total': t2 - t0}
+if len(sys.argv) > 7:
+    for target in targets:
+        target.hashes = {}
+    entries = megazord.utils.file_hash_cache.entries
+    megazord.utils.file_hash_cache.entries = {}
+    t3 = time.perf_counter()
+    targets[0].hash()
+    t4 = time.perf_counter()
+    megazord.utils.file_hash_cache.entries = entries
+    for target in targets:
+        target.hashes = {}
+    targets[0].hash()
+    t5 = time.perf_counter()
+    storage = megazord.interstate.target_storage
+    storage.close()
+    t6 = time.perf_counter()
+    state = storage.load()
+    t7 = time.perf_counter()
+    storage.backend.save_targets(state)
+    t8 = time.perf_counter()
+    result.update({'hash_cold': t4 - t3, 'hash_warm': t5 - t4, 'interstate_load': t7 - t6, 'interstate_save': t8 - t7})
+print(json.dumps(result))
+"""
+
+
+def build(path, shape, count, jobs, incremental, measure_internals=False):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['MEGAZORD_ROOT'] = path
+    args = [sys.executable, '-c', BUILD, shape, str(count), str(jobs), '1' if incremental else '0', FAKE_CC,
+            os.path.dirname(os.path.abspath(__file__))]
+    if measure_internals:
+        args.append('internals')
+    output = subprocess.check_output(args, cwd=path, env=env, stderr=subprocess.DEVNULL).decode('utf-8')
+    return json.loads(output.strip().split('\n')[-1])
+
+
+def touch(path, content):
+    # Modification must be visible to stat-based caches, so change size too
+    with open(path, 'a') as f:
+        f.write(content)
+
+
+def bench_shape(shape, args):
+    results = {}
+    path = tempfile.mkdtemp(prefix='megazord-bench-')
+    try:
+        generate(path, args.targets, args.sources)
+        results['cold'] = build(path, shape, args.targets, args.jobs, args.incremental)
+        results['noop'] = build(path, shape, args.targets, args.jobs, args.incremental, measure_internals=True)
+        # The first no-op build records the graph snapshot, the next one takes the fast path
+        results['noop_snapshot'] = build(path, shape, args.targets, args.jobs, args.incremental)
+        touch(os.path.join(path, 'src', 't{}'.format(args.targets - 1), 's0.cpp'), '// touched\n')
+        results['touch_source'] = build(path, shape, args.targets, args.jobs, args.incremental)
+        touch(os.path.join(path, 'include', 't{}.h'.format(args.targets - 1)), '// touched\n')
+        results['touch_header'] = build(path, shape, args.targets, args.jobs, args.incremental)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def start_workers(count, jobs):
+    """
+    :return: list of worker processes and list of their addresses
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    processes = []
+    addresses = []
+    for _ in range(count):
+        process = subprocess.Popen([sys.executable, '-m', 'megazord', 'worker', '--port', '0', '--jobs', str(jobs),
+                                    '--compiler', FAKE_CC], stdout=subprocess.PIPE, env=env,
+                                   cwd=tempfile.gettempdir())
+        processes.append(process)
+        addresses.append(process.stdout.readline().decode('utf-8').split()[3])
+    return processes, addresses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', type=int, default=50)
+    parser.add_argument('--sources', type=int, default=5)
+    parser.add_argument('--shapes', default=','.join(SHAPES))
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--sleep', type=float, default=0.0, help='seconds the fake compiler spends per source')
+    parser.add_argument('--incremental', action='store_true', help='compile every source to its own object')
+    parser.add_argument('--workers', type=int, default=0, help='compile objects on this many local workers')
+    parser.add_argument('--output', default=None, help='write results as JSON to the file')
+    args = parser.parse_args()
+    os.environ['FAKE_CC_SLEEP'] = str(args.sleep)
+    workers = []
+    if args.workers:
+        workers, addresses = start_workers(args.workers, args.jobs)
+        os.environ['BENCH_WORKERS'] = ','.join(addresses)
+
+    report = {'benchmark': 'synthetic', 'unit': 's', 'python': platform.python_version(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'parameters': {'targets': args.targets, 'sources': args.sources, 'jobs': args.jobs,
+                             'sleep': args.sleep, 'incremental': args.incremental, 'workers': args.workers},
+              'results': {}}
+    try:
+        for shape in args.shapes.split(','):
+            report['results'][shape] = bench_shape(shape, args)
+            for scenario, timings in report['results'][shape].items():
+                print("{:<8} {:<13} {}".format(shape, scenario, ' '.join(
+                    '{}={:.4f}'.format(key, value) for key, value in timings.items())))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
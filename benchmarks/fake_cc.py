@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Stand-in C/C++ compiler for benchmarks. It understands the subset of gcc flags megazord passes: it sleeps
+$FAKE_CC_SLEEP seconds per source, writes deterministic outputs derived from contents of inputs and writes
+depfiles for -MMD/-MF and -MM by scanning #include "..." directives. -E writes the source followed by its headers.
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+
+INCLUDE = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.M)
+SOURCES = ('.c', '.cpp', '.cc', '.cxx', '.i', '.ii', '.o')
+
+
+def headers(source, include_paths, seen=None):
+    seen = [] if seen is None else seen
+    with open(source) as f:
+        content = f.read()
+    for name in INCLUDE.findall(content):
+        for directory in [os.path.dirname(source)] + include_paths:
+            candidate = os.path.normpath(os.path.join(directory, name))
+            if os.path.isfile(candidate):
+                if candidate not in seen:
+                    seen.append(candidate)
+                    headers(candidate, include_paths, seen)
+                break
+    return seen
+
+
+def main(argv):
+    if argv == ['--version']:
+        sys.stdout.write('fake_cc 1.0\n')
+        return 0
+    output = 'a.out'
+    depfile = None
+    depends_only = False
+    preprocess_only = False
+    include_paths = []
+    sources = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '-MF':
+            depfile = argv[i + 1]
+            i += 1
+        elif arg == '-MM':
+            depends_only = True
+        elif arg == '-E':
+            preprocess_only = True
+        elif arg.startswith('-o'):
+            output = arg[2:] or argv[i + 1]
+            i += 0 if arg[2:] else 1
+        elif arg.startswith('-I'):
+            include_paths.append(arg[2:])
+        elif not arg.startswith('-') and arg.endswith(SOURCES):
+            sources.append(arg)
+        i += 1
+
+    rules = []
+    for source in sources:
+        if not source.endswith('.o'):
+            rules.append('{}: {}'.format(os.path.splitext(os.path.basename(source))[0] + '.o',
+                                         ' '.join([source] + headers(source, include_paths))))
+    if depends_only:
+        sys.stdout.write('\n'.join(rules) + '\n')
+        return 0
+
+    if preprocess_only:
+        with open(output, 'wb') as f:
+            for source in sources:
+                for path in [source] + headers(source, include_paths):
+                    with open(path, 'rb') as included:
+                        f.write(included.read())
+    else:
+        time.sleep(float(os.environ.get('FAKE_CC_SLEEP', '0')) * len([s for s in sources if not s.endswith('.o')]))
+        h = hashlib.md5()
+        for source in sources:
+            with open(source, 'rb') as f:
+                h.update(f.read())
+        with open(output, 'w') as f:
+            f.write(h.hexdigest() + '\n')
+    if depfile is not None:
+        with open(depfile, 'w') as f:
+            included = []
+            for source in sources:
+                if not source.endswith('.o'):
+                    included.extend(h for h in headers(source, include_paths) if h not in included)
+            f.write('{}: {}\n'.format(output, ' '.join(sources + included)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,14 +3,36 @@ __author__ = "Pasha Podolsky"
 __name__ = 'megazord'
 __homepage__ = "http://github.com/PashaPodolsky/megazord/"
 
-from .tools import *
-from .target import *
+import importlib
 
-import megazord.meta as meta
-import megazord.system as system
-import megazord.utils as tools
-import megazord.interstate as interstate
+# Submodules and public classes are imported on first access, so importing megazord has no side effects
+submodules = ['aio', 'cache', 'classfile', 'costs', 'deploy', 'events', 'explain', 'interstate', 'jar', 'javaserver', 'jobserver', 'meta', 'remote', 'scheduler', 'snapshot', 'system', 'target', 'toolchain', 'tools', 'utils', 'watch']
+exports = {'Target': 'target',
+           'GenericTool': 'tools',
+           'GenericCompiler': 'tools',
+           'CCompiler': 'tools',
+           'DmdCompiler': 'tools',
+           'GccCompiler': 'tools',
+           'GppCompiler': 'tools',
+           'ClangCompiler': 'tools',
+           'ClangppCompiler': 'tools',
+           'JarTool': 'tools',
+           'JavaCompiler': 'tools'}
 
 __all__ = ['Target']
 
 verbose = 2
+
+
+def __getattr__(name):
+    if name in submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name in exports:
+        value = getattr(importlib.import_module('.' + exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + submodules + list(exports.keys()))
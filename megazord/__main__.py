@@ -0,0 +1,54 @@
+"""
+Command line interface of megazord: python -m megazord <command>
+"""
+
+import argparse
+import megazord
+
+
+def refresh(args):
+    megazord.toolchain.refresh()
+    megazord.system.info("Toolchain probes were dropped")
+
+
+def explain(args):
+    if not megazord.interstate.is_init():
+        megazord.system.info("Nothing was built in {}".format(megazord.interstate.root()))
+        return
+    explanation = megazord.explain.last()
+    if args.targets:
+        explanation = {name: reasons for name, reasons in explanation.items() if name in args.targets}
+    print(megazord.explain.report(explanation))
+
+
+def worker(args):
+    megazord.remote.serve(args.host, args.port, args.jobs, args.compiler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='megazord')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    refresh_parser = commands.add_parser('refresh', help='drop cached toolchain probes (tool paths, versions, *-config)')
+    refresh_parser.set_defaults(func=refresh)
+
+    explain_parser = commands.add_parser('explain', help='show why targets were rebuilt by their last assembly')
+    explain_parser.add_argument('targets', nargs='*', help='names of targets, all of them by default')
+    explain_parser.set_defaults(func=explain)
+
+    worker_parser = commands.add_parser('worker', help='compile objects sent by other hosts, see megazord.remote')
+    worker_parser.add_argument('--host', default='127.0.0.1', help='address to listen, 0.0.0.0 for all interfaces')
+    worker_parser.add_argument('--port', type=int, default=megazord.remote.DEFAULT_PORT, help='0 for a free one')
+    worker_parser.add_argument('--jobs', type=int, default=None, help='concurrent compilations, CPU count by default')
+    worker_parser.add_argument('--compiler', action='append', default=None,
+                               help='compiler allowed to run, may be repeated ({} by default)'.format(
+                                   ', '.join(megazord.remote.COMPILERS)))
+    worker_parser.set_defaults(func=worker)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Asyncio counterparts of megazord.system.call and megazord.scheduler. They allow one event loop to drive
+many concurrent builds without a thread per build.
+"""
+
+import os
+import time
+import signal
+import asyncio
+import weakref
+import contextvars
+import subprocess
+import megazord
+
+limit = None
+semaphores = weakref.WeakKeyDictionary()
+
+
+def set_limit(processes):
+    """
+    Bounds number of processes spawned concurrently by call() within one event loop
+    :param processes: maximal number of processes or None for no limit
+    """
+    global limit
+    limit = processes
+    semaphores.clear()
+
+
+def semaphore():
+    if limit is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if loop not in semaphores:
+        semaphores[loop] = asyncio.Semaphore(limit)
+    return semaphores[loop]
+
+
+async def blocking(function, *args):
+    """
+    Runs blocking function (file hashing, tool probing, interstate and cache I/O) in the default executor of the
+    running loop, within the current context
+    :return: result of the function
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, function, *args)
+
+
+async def call(cmd, *args, timeout=None, cwd=None):
+    """
+    Runs process and returns its output like megazord.system.call. The process is killed if the call is
+    cancelled or runs longer than timeout seconds, subprocess.TimeoutExpired is raised in the latter case.
+    """
+    bound = semaphore()
+    if bound is None:
+        async with megazord.jobserver.token_async():
+            return await spawn(cmd, args, timeout, cwd)
+    async with bound, megazord.jobserver.token_async():
+        return await spawn(cmd, args, timeout, cwd)
+
+
+async def spawn(cmd, args, timeout, cwd):
+    t = [cmd]
+    t.extend(args)
+    print("Run: {}".format(' '.join(t)))
+    start = time.perf_counter()
+    # Not an asyncio subprocess: its child watcher reaps processes by waitpid, which drops resource usage
+    process = subprocess.Popen(t, stdout=subprocess.PIPE, cwd=cwd, pass_fds=megazord.jobserver.inherited())
+    megazord.costs.started()
+    megazord.events.emit('spawn', command=t, pid=process.pid)
+    max_rss = None
+    finished = asyncio.ensure_future(communicate(process))
+    try:
+        output, max_rss = await asyncio.wait_for(asyncio.shield(finished), timeout)
+    except asyncio.TimeoutError:
+        await kill(process, finished)
+        raise subprocess.TimeoutExpired(t, timeout)
+    except BaseException:
+        await kill(process, finished)
+        raise
+    finally:
+        megazord.costs.finished(max_rss)
+    megazord.events.emit('exit', command=t, pid=process.pid, start=start, duration=time.perf_counter() - start,
+                         returncode=process.returncode, max_rss=max_rss)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, t, output)
+    return output
+
+
+async def communicate(process):
+    """
+    Reads output of the process and reaps it without blocking the loop
+    :param process: subprocess.Popen with stdout=PIPE
+    :return: output and peak resident set of the process in bytes
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stdout)
+    try:
+        output = await reader.read()
+    finally:
+        transport.close()
+    _, status, rusage = await wait4(process.pid)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return output, megazord.events.max_rss(rusage)
+
+
+async def wait4(pid):
+    """
+    Waits for the child to exit and reaps it
+    :return: result of os.wait4
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No pidfd (not Linux or an old kernel), a thread waits instead
+        return await loop.run_in_executor(None, os.wait4, pid, 0)
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    return os.wait4(pid, 0)
+
+
+async def kill(process, finished):
+    """
+    Kills the process and waits until it is reaped by finished, the communicate() task
+    """
+    if process.returncode is None:
+        # Popen.kill() polls the process first, which would reap it without resource usage
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await asyncio.wait([finished])
+
+
+async def gather(*aws):
+    """
+    Like asyncio.gather, but cancels the rest of awaitables as soon as one of them fails
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if len(tasks) == 0:
+        return []
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        failed = any(task.done() and not task.cancelled() and task.exception() is not None for task in tasks)
+        if failed or not all(task.done() for task in tasks):
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+    return [task.result() for task in tasks]
+
+
+class Skipped(Exception):
+    pass
+
+
+async def assembly(root, forced=None, jobs=None, keep_going=False, timeout=None):
+    """
+    Asynchronous counterpart of megazord.scheduler.Scheduler.run
+    :param root: Target
+    :param forced: forced rebuild even if cached version is presented. Override class variable.
+    :param jobs: number of targets assembled concurrently, unlimited by default
+    :param keep_going: don't stop on the first failure, assemble everything that doesn't depend on failed targets
+    :param timeout: timeout in seconds for every spawned process
+    :return: returns root
+    """
+    order, forces = megazord.scheduler.collect(root, forced)
+    if await blocking(megazord.snapshot.up_to_date, order, forces):
+        return root
+    for target in order:
+        target.hashes = {}
+    started = time.time_ns()
+    bound = asyncio.Semaphore(jobs) if jobs else None
+    tasks = {}
+    failures = {}
+    skipped = []
+
+    async def build(target):
+        dependencies = [tasks[dependency] for dependency in set(target.dependencies)]
+        if dependencies:
+            await asyncio.wait(dependencies)
+        if any(task.cancelled() or task.exception() is not None for task in dependencies):
+            skipped.append(target)
+            raise Skipped()
+        if bound is None:
+            await target.assembly_self_async(forces[target], timeout)
+        else:
+            async with bound:
+                await target.assembly_self_async(forces[target], timeout)
+
+    with megazord.interstate.transaction():
+        try:
+            for target in order:
+                tasks[target] = asyncio.ensure_future(build(target))
+            targets = {task: target for target, task in tasks.items()}
+            pending = set(tasks.values())
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), Skipped):
+                        failures[targets[task]] = task.exception()
+                if failures and not keep_going:
+                    break
+        finally:
+            unfinished = [task for task in tasks.values() if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.wait(unfinished)
+            await blocking(megazord.utils.file_hash_cache.save)
+            # Committed changes aren't written again at the end of the transaction
+            await blocking(megazord.interstate.target_storage.commit)
+    if failures:
+        if not keep_going:
+            raise next(iter(failures.values()))
+        raise megazord.scheduler.BuildError(failures, skipped)
+    await blocking(megazord.snapshot.record, order, started)
+    return root
@@ -0,0 +1,235 @@
+"""
+Content-addressed artifact cache shared by all checkouts on the machine. Outputs of targets are stored
+under the key built from the target hash, compiler identity and flags and restored instead of compilation.
+Every key may have several variants differing by contents of included headers.
+"""
+
+import os
+import stat
+import json
+import gzip
+import shutil
+import hashlib
+import tempfile
+import threading
+import megazord
+
+artifact_cache = None
+
+
+def default_path():
+    if 'MEGAZORD_CACHE_DIR' in os.environ:
+        return os.environ['MEGAZORD_CACHE_DIR']
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'megazord', 'artifacts')
+
+
+def enable(path=None, max_size=10 * 1024 ** 3, compress=False, hardlink=False):
+    """
+    Enables artifact cache for all targets
+    :param path: cache directory, by default $MEGAZORD_CACHE_DIR or ~/.cache/megazord/artifacts
+    :param max_size: size budget of the cache in bytes, least recently used entries are evicted above it
+    :param compress: store outputs gzipped
+    :param hardlink: restore outputs by hardlinks instead of copies (ignored when compress is True). Hardlinked
+    outputs are read-only, so tools can't rewrite cache entries in place.
+    :return: returns ArtifactCache
+    """
+    global artifact_cache
+    artifact_cache = ArtifactCache(path, max_size, compress, hardlink)
+    return artifact_cache
+
+
+def disable():
+    global artifact_cache
+    artifact_cache = None
+
+
+class ArtifactCache:
+    def __init__(self, path=None, max_size=10 * 1024 ** 3, compress=False, hardlink=False):
+        self.path = path or default_path()
+        self.max_size = max_size
+        self.compress = compress
+        self.hardlink = hardlink and not compress
+        # Estimate of the cache size, entries are walked only when it goes over the budget
+        self.total = None
+        self.lock = threading.Lock()
+        megazord.system.mkdir_p(self.path)
+
+    def key(self, target):
+        """
+        :return: key of target outputs. It covers all inputs of the target, compiler identity, flags and
+        absolute paths baked into outputs (rpath), so checkouts don't restore outputs referring to each other
+        """
+        components = [target.hash(headers=False), target.compiler.identity(), target.output]
+        components.extend(target.options)
+        components.extend(target.compiler.link_paths(target))
+        h = hashlib.md5()
+        for component in components:
+            h.update(component.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def headers_digests(self, target):
+        """
+        :return: dict of digests of headers included by the target and all its dependencies
+        """
+        headers = []
+        stack = [target]
+        while stack:
+            t = stack.pop()
+            headers.extend(t.get_headers())
+            stack.extend(t.dependencies)
+        headers = sorted(set(headers))
+        return dict(zip(headers, megazord.utils.headers_hashes(headers)))
+
+    def variants(self, key):
+        entry = self.entry(key)
+        if not os.path.isdir(entry):
+            return []
+        result = []
+        for variant in os.listdir(entry):
+            try:
+                with open(os.path.join(entry, variant, 'headers.json')) as f:
+                    result.append((os.path.join(entry, variant), json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def restore(self, key, target):
+        """
+        Restores outputs of the target from the cache
+        :return: True if outputs were found in the cache
+        """
+        for variant, headers in self.variants(key):
+            digests = headers['digests']
+            if digests != dict(zip(digests, megazord.utils.headers_hashes(list(digests)))):
+                continue
+            blob = os.path.join(variant, 'output.gz' if self.compress else 'output')
+            if not os.path.isfile(blob):
+                continue
+            try:
+                self.place(blob, target.output_dir + target.output)
+                os.utime(variant)
+            except (OSError, EOFError):
+                # The entry was evicted concurrently
+                continue
+            megazord.interstate.target_storage[target.name]['headers'] = headers['headers']
+            target.compiler.restored(target)
+            return True
+        return False
+
+    def place(self, blob, output):
+        """
+        Atomically replaces output by the contents of blob, the output is untouched if blob can't be read
+        """
+        tmp_file = megazord.system.mkstemp(os.path.dirname(output) or '.')
+        try:
+            if self.compress:
+                with gzip.open(blob, 'rb') as src, open(tmp_file, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                shutil.copymode(blob, tmp_file)
+            else:
+                try:
+                    if not self.hardlink:
+                        raise OSError
+                    os.remove(tmp_file)
+                    os.link(blob, tmp_file)
+                    # The output is the cache entry itself
+                    os.chmod(tmp_file, stat.S_IMODE(os.stat(tmp_file).st_mode) & ~0o222)
+                except OSError:
+                    shutil.copyfile(blob, tmp_file)
+                    shutil.copymode(blob, tmp_file)
+            os.replace(tmp_file, output)
+        except BaseException:
+            if os.path.lexists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def detach(self, target):
+        """
+        Removes the output of the target if it is hardlinked to a cache entry, so the compiler doesn't write into it
+        """
+        output = target.output_dir + target.output
+        if self.hardlink and os.path.isfile(output) and not os.path.islink(output) and os.stat(output).st_nlink > 1:
+            os.remove(output)
+
+    def store(self, key, target):
+        """
+        Puts outputs of the target into the cache and evicts old entries above the size budget
+        """
+        output = target.output_dir + target.output
+        headers = {'headers': target.get_headers(), 'digests': self.headers_digests(target)}
+        variant = hashlib.md5(json.dumps(headers, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        entry = os.path.join(self.entry(key), variant)
+        if not os.path.isfile(output) or os.path.isdir(entry):
+            return
+        megazord.system.mkdir_p(os.path.dirname(entry))
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry))
+        try:
+            if self.compress:
+                blob = os.path.join(tmp_dir, 'output.gz')
+                with open(output, 'rb') as src, gzip.open(blob, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            else:
+                blob = os.path.join(tmp_dir, 'output')
+                shutil.copyfile(output, blob)
+            shutil.copymode(output, blob)
+            with open(os.path.join(tmp_dir, 'headers.json'), 'w') as f:
+                json.dump(headers, f)
+            size = sum(os.path.getsize(os.path.join(tmp_dir, f)) for f in os.listdir(tmp_dir))
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # Another process has stored the same entry concurrently
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self.lock:
+            if self.total is not None:
+                self.total += size
+            if self.max_size is None or (self.total is not None and self.total <= self.max_size):
+                return
+        self.evict()
+
+    def entries(self):
+        result = []
+        for prefix in os.listdir(self.path):
+            prefix_dir = os.path.join(self.path, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                for variant in os.listdir(os.path.join(prefix_dir, key)):
+                    entry = os.path.join(prefix_dir, key, variant)
+                    try:
+                        size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                        result.append((os.path.getmtime(entry), size, entry))
+                    except OSError:
+                        continue
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits into its size budget
+        """
+        if self.max_size is None:
+            return
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            # Evicting a bit more than needed keeps the next stores from walking the cache again
+            low_water = self.max_size * 0.9 if total > self.max_size else self.max_size
+            for _, size, entry in entries:
+                if total <= low_water:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+            self.total = total
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        megazord.system.mkdir_p(self.path)
+        with self.lock:
+            self.total = 0
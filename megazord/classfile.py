@@ -0,0 +1,121 @@
+"""
+Minimal reader of Java .class files. It extracts the name of the class, the source file it was compiled from,
+names of all classes it references through the constant pool and type descriptors, its supertypes and whether
+it has compile-time constants, which javac inlines into other classes without references.
+"""
+
+import re
+import struct
+
+MAGIC = 0xCAFEBABE
+DESCRIPTOR_CLASS = re.compile(r'L([^;<]+)[;<]')
+
+# Sizes of constant pool entries by tag, Utf8 entries have variable size
+CONSTANT_SIZES = {3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4, 15: 3, 16: 2, 17: 4, 18: 4,
+                  19: 2, 20: 2}
+
+
+class ClassInfo:
+    def __init__(self, name, source_file, references, supertypes=None, constants=False):
+        """
+        :param name: internal name of the class, i.e. 'com/example/Board$Cell'
+        :param source_file: name of the source file without directories or None
+        :param references: set of internal names of referenced classes
+        :param supertypes: list of internal names of the superclass and interfaces
+        :param constants: True if the class has fields with constant values
+        """
+        self.name = name
+        self.source_file = source_file
+        self.references = references
+        self.supertypes = supertypes or []
+        self.constants = constants
+
+    def package(self):
+        return self.name.rpartition('/')[0]
+
+    def __repr__(self):
+        return 'ClassInfo({})'.format(self.name)
+
+
+def class_name(name):
+    """
+    :return: internal class name stripped from array descriptor or None for arrays of primitive types
+    """
+    if name.startswith('['):
+        element = name.lstrip('[')
+        return element[1:-1] if element.startswith('L') else None
+    return name
+
+
+def parse(path):
+    with open(path, 'rb') as f:
+        return parse_bytes(f.read())
+
+
+def parse_bytes(data):
+    magic, = struct.unpack_from('>I', data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a class file")
+    count, = struct.unpack_from('>H', data, 8)
+    offset = 10
+    utf8 = {}
+    classes = {}
+    descriptors = []
+    index = 1
+    while index < count:
+        tag = data[offset]
+        offset += 1
+        if tag == 1:
+            length, = struct.unpack_from('>H', data, offset)
+            utf8[index] = data[offset + 2:offset + 2 + length].decode('utf-8', 'replace')
+            offset += 2 + length
+        elif tag in CONSTANT_SIZES:
+            if tag == 7:
+                classes[index] = struct.unpack_from('>H', data, offset)[0]
+            elif tag == 12:
+                descriptors.append(struct.unpack_from('>H', data, offset + 2)[0])
+            elif tag == 16:
+                descriptors.append(struct.unpack_from('>H', data, offset)[0])
+            offset += CONSTANT_SIZES[tag]
+        else:
+            raise ValueError("Unknown constant pool tag {}".format(tag))
+        # Long and Double take two entries of the pool
+        index += 2 if tag in (5, 6) else 1
+
+    _, this_class, super_class, interfaces_count = struct.unpack_from('>HHHH', data, offset)
+    interfaces = struct.unpack_from('>{}H'.format(interfaces_count), data, offset + 8)
+    supertypes = [utf8.get(classes.get(index), '') for index in (super_class,) + interfaces if index != 0]
+    offset += 8 + 2 * interfaces_count
+    constants = False
+    for members in ('fields', 'methods'):
+        # Fields and methods have the same layout
+        members_count, = struct.unpack_from('>H', data, offset)
+        offset += 2
+        for _ in range(members_count):
+            _, _, descriptor, attributes_count = struct.unpack_from('>HHHH', data, offset)
+            descriptors.append(descriptor)
+            offset += 8
+            for _ in range(attributes_count):
+                name, length = struct.unpack_from('>HI', data, offset)
+                if members == 'fields' and utf8.get(name) == 'ConstantValue':
+                    constants = True
+                offset += 6 + length
+    source_file = None
+    attributes_count, = struct.unpack_from('>H', data, offset)
+    offset += 2
+    for _ in range(attributes_count):
+        name, length = struct.unpack_from('>HI', data, offset)
+        if utf8.get(name) == 'SourceFile':
+            source_file = utf8.get(struct.unpack_from('>H', data, offset + 6)[0])
+        offset += 6 + length
+
+    references = set()
+    for name_index in classes.values():
+        referenced = class_name(utf8.get(name_index, ''))
+        if referenced:
+            references.add(referenced)
+    for descriptor_index in descriptors:
+        references.update(DESCRIPTOR_CLASS.findall(utf8.get(descriptor_index, '')))
+    name = utf8[classes[this_class]]
+    references.discard(name)
+    return ClassInfo(name, source_file, references, supertypes, constants)
@@ -0,0 +1,107 @@
+"""
+Costs of targets: wall-clock duration of their assembly and memory of processes spawned by it. They are measured
+whenever a target is built and kept in interstate. The scheduler starts targets on the longest remaining path first
+and admits targets while their expected memory fits into the budget.
+"""
+
+import threading
+import contextvars
+import contextlib
+import megazord
+
+current = contextvars.ContextVar('megazord_meter', default=None)
+
+
+class Meter:
+    """
+    Collects the largest resident set of processes spawned for one target and the number of them running at once
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.parallelism = 0
+        self.max_rss = 0
+
+    def started(self):
+        with self.lock:
+            self.running += 1
+            self.parallelism = max(self.parallelism, self.running)
+
+    def finished(self, max_rss):
+        with self.lock:
+            self.running -= 1
+            if max_rss is not None:
+                self.max_rss = max(self.max_rss, max_rss)
+
+
+@contextlib.contextmanager
+def measuring():
+    """
+    Measures processes spawned in the block, including threads and tasks started from the current context
+    """
+    meter = Meter()
+    token = current.set(meter)
+    try:
+        yield meter
+    finally:
+        current.reset(token)
+
+
+def started():
+    meter = current.get()
+    if meter is not None:
+        meter.started()
+
+
+def finished(max_rss):
+    """
+    :param max_rss: peak resident set of the exited process in bytes or None if it is unknown
+    """
+    meter = current.get()
+    if meter is not None:
+        meter.finished(max_rss)
+
+
+def record(target, duration, meter):
+    old = megazord.interstate.target_storage[target.name]['cost'] or {}
+    megazord.interstate.target_storage[target.name]['cost'] = {
+        'duration': duration,
+        # Compilations on the Java compile server don't report their memory
+        'max_rss': meter.max_rss or old.get('max_rss', 0),
+        'parallelism': max(meter.parallelism, 1),
+    }
+
+
+def duration(target):
+    """
+    :return: duration of the last build of the target in seconds or None if it was never built
+    """
+    cost = megazord.interstate.target_storage[target.name]['cost']
+    return None if cost is None else cost['duration']
+
+
+def memory(target):
+    """
+    :return: expected memory of processes of the target running at once in bytes, 0 if it is unknown
+    """
+    cost = megazord.interstate.target_storage[target.name]['cost']
+    return 0 if cost is None else cost['max_rss'] * cost['parallelism']
+
+
+def priorities(order):
+    """
+    :param order: targets in dependency order
+    :return: dict {target: expected duration of the longest path from the start of the target to the end of the build}
+    """
+    durations = {target: duration(target) for target in order}
+    known = [value for value in durations.values() if value is not None]
+    default = sum(known) / len(known) if known else 1.0
+    dependents = {target: [] for target in order}
+    for target in order:
+        for dependency in set(target.dependencies):
+            dependents[dependency].append(target)
+    remaining = {}
+    for target in reversed(order):
+        own = durations[target] if durations[target] is not None else default
+        remaining[target] = own + max((remaining[dependent] for dependent in dependents[target]), default=0)
+    return remaining
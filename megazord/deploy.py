@@ -0,0 +1,188 @@
+"""
+Incremental deployment of target outputs. Every destination folder keeps a manifest of deployed files with their
+digests, so only files changed since the last deployment are written. Files are cloned (reflinks) or copied in the
+kernel by copy_file_range where the filesystem allows, falling back to byte copies, and optionally hardlinked.
+Symlinks, i.e. 'lib' aliases of shared libraries, are deployed as symlinks.
+"""
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import concurrent.futures
+import megazord
+
+MANIFEST = '.megazord-manifest.json'
+FICLONE = 0x40049409
+
+
+def collect(target, with_dependencies=True, exclude=None):
+    """
+    :return: list of targets to deploy, every target of the graph once
+    """
+    exclude = exclude if isinstance(exclude, list) else [exclude]
+    result = []
+
+    def visit(current):
+        if current in result or current in exclude:
+            return
+        if with_dependencies:
+            for dependency in current.dependencies:
+                visit(dependency)
+        result.append(current)
+
+    if target in exclude:
+        return []
+    visit(target)
+    return result
+
+
+def outputs(target):
+    """
+    :return: list of (source path, path relative to the destination) of deployed files of the target
+    """
+    output = target.output_dir + target.output
+    if not os.path.lexists(output):
+        raise FileNotFoundError("Output {} of {} doesn't exist".format(output, target.name))
+    files = [(output, target.output)]
+    alias = target.output_dir + 'lib' + target.output
+    if os.path.islink(alias):
+        files.append((alias, 'lib' + target.output))
+    if os.path.isdir(output) and not os.path.islink(output):
+        files = []
+        for root, directories, names in os.walk(output):
+            for name in sorted(directories + names):
+                path = os.path.join(root, name)
+                if os.path.islink(path) or os.path.isfile(path):
+                    files.append((path, os.path.join(target.output, os.path.relpath(path, output))))
+    return files
+
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp_file = megazord.system.mkstemp(path)
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.chmod(tmp_file, 0o644)
+    os.replace(tmp_file, os.path.join(path, MANIFEST))
+
+
+def stat_key(path):
+    stat = os.lstat(path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def clone(src, dst):
+    """
+    Copies src to dst by a reflink, copy_file_range or a byte copy, whichever is the first to work
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except (OSError, AttributeError):
+            # Another filesystem or kernel without copy_file_range, copy the rest in userspace
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, 1024 ** 2)
+
+
+def place(src, dst, hardlink=False):
+    """
+    Atomically replaces dst by a copy of src or by a hardlink to it
+    """
+    megazord.system.mkdir_p(os.path.dirname(dst))
+    tmp_file = megazord.system.mkstemp(os.path.dirname(dst))
+    try:
+        if os.path.islink(src):
+            os.remove(tmp_file)
+            os.symlink(os.readlink(src), tmp_file)
+        elif hardlink:
+            os.remove(tmp_file)
+            try:
+                os.link(src, tmp_file)
+            except OSError:
+                clone(src, tmp_file)
+                shutil.copymode(src, tmp_file)
+        else:
+            clone(src, tmp_file)
+            shutil.copymode(src, tmp_file)
+        os.replace(tmp_file, dst)
+    except BaseException:
+        if os.path.lexists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def deploy(target, path, with_dependencies=True, exclude=None, jobs=None, hardlink=False):
+    """
+    Deploys outputs of the target and its dependencies to the folder, writing only files changed since the last
+    deployment there
+    :param exclude: target or list of targets not deployed together with their dependencies
+    :param jobs: number of files written concurrently
+    :param hardlink: deploy files by hardlinks instead of copies where possible. Deployed files change together
+    with outputs then.
+    :return: list of written paths
+    """
+    targets = collect(target, with_dependencies, exclude)
+    for current in targets:
+        if not current.compiled:
+            raise LookupError('{} is not compiled yet!'.format(current.name))
+    megazord.system.mkdir_p(path)
+    manifest = load_manifest(path)
+    files = {}
+    for current in targets:
+        for src, name in outputs(current):
+            files.setdefault(name, (src, current))
+    regular = [src for src, _ in files.values() if not os.path.islink(src)]
+    digests = dict(zip(regular, megazord.utils.digests(regular)))
+    pending = []
+    for name, (src, current) in sorted(files.items()):
+        dst = os.path.join(path, name)
+        entry = {'link': os.readlink(src)} if os.path.islink(src) else {'digest': digests[src]}
+        old = manifest.get(name)
+        if old is not None and os.path.lexists(dst) and old.get('stat') == stat_key(dst) and \
+                all(old.get(key) == value for key, value in entry.items()):
+            continue
+        pending.append((name, src, dst, entry, current))
+
+    starts = {}
+
+    def write(name, src, dst, entry, current):
+        starts.setdefault(current, time.perf_counter())
+        place(src, dst, hardlink)
+        return name, dict(entry, stat=stat_key(dst))
+
+    with concurrent.futures.ThreadPoolExecutor(jobs or min(len(pending), os.cpu_count() or 1) or 1) as executor:
+        futures = [executor.submit(write, *item) for item in pending]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                name, entry = future.result()
+                manifest[name] = entry
+        finally:
+            save_manifest(path, manifest)
+    for current in targets:
+        start = starts.get(current, time.perf_counter())
+        megazord.events.emit('deploy', target=current.name, path=path, start=start,
+                             duration=time.perf_counter() - start)
+    megazord.system.info("Deployed {} of {} files to {}".format(len(pending), len(files), path))
+    return [dst for _, _, dst, _, _ in pending]
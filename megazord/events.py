@@ -0,0 +1,227 @@
+"""
+Events describe what megazord is doing: assembly of targets, hashing, cache lookups, spawned processes and
+deployment. Register a listener to receive them, i.e. ChromeTrace to look at the build in chrome://tracing
+or Summary to find the critical path and the slowest targets.
+
+Every event is a dict with 'kind', 'time' (time.perf_counter() in seconds), 'thread' and kind-specific fields:
+    target_start  target, dependencies
+    target_finish target, start, duration, status ('built', 'cached', 'restored' or 'failed')
+    hash          target, start, duration
+    cache         target, cache ('interstate' or 'artifact'), hit
+    spawn         command, pid
+    exit          command, pid, start, duration, returncode, max_rss (bytes, None for the Java compile server)
+    deploy        target, path, start, duration
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+listeners = []
+lock = threading.Lock()
+
+
+def add_listener(listener):
+    """
+    :param listener: callable receiving every event
+    :return: returns listener
+    """
+    with lock:
+        listeners.append(listener)
+    return listener
+
+
+def remove_listener(listener):
+    with lock:
+        if listener in listeners:
+            listeners.remove(listener)
+
+
+def enabled():
+    return len(listeners) > 0
+
+
+def emit(kind, **fields):
+    if not listeners:
+        return
+    fields['kind'] = kind
+    fields['time'] = time.perf_counter()
+    fields['thread'] = threading.get_ident()
+    for listener in list(listeners):
+        listener(fields)
+
+
+@contextlib.contextmanager
+def listening(*new_listeners):
+    """
+    Registers listeners for the duration of the block
+    """
+    for listener in new_listeners:
+        add_listener(listener)
+    try:
+        yield new_listeners
+    finally:
+        for listener in new_listeners:
+            remove_listener(listener)
+
+
+def max_rss(rusage):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+
+
+class ChromeTrace:
+    """
+    Collects events and exports them in Chrome trace-event JSON format
+    """
+    spans = {'target_finish': 'target', 'hash': 'hash', 'exit': 'process', 'deploy': 'deploy'}
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def name(self, event):
+        if 'target' in event:
+            return event['target']
+        return os.path.basename(event['command'][0])
+
+    def trace(self):
+        """
+        :return: dict in trace-event format. Overlapping spans are placed on separate lanes.
+        """
+        with self.lock:
+            events = list(self.events)
+        origin = min([e.get('start', e['time']) for e in events] or [0])
+        spans = sorted([e for e in events if e['kind'] in self.spans], key=lambda e: (e['start'], -e['duration']))
+        lanes = {}
+        threads = {}
+        trace_events = []
+        for event in spans:
+            category = self.spans[event['kind']]
+            category_lanes = lanes.setdefault(category, [])
+            for lane, end in enumerate(category_lanes):
+                if end <= event['start']:
+                    break
+            else:
+                lane = len(category_lanes)
+                category_lanes.append(0)
+            category_lanes[lane] = event['start'] + event['duration']
+            args = {k: v for k, v in event.items() if k not in ('kind', 'time', 'thread', 'start', 'duration')}
+            trace_events.append({'name': self.name(event), 'cat': category, 'ph': 'X', 'pid': 1,
+                                 'tid': self.thread(threads, '{} {}'.format(category, lane)),
+                                 'ts': (event['start'] - origin) * 1e6, 'dur': event['duration'] * 1e6,
+                                 'args': args})
+        for event in events:
+            if event['kind'] == 'cache':
+                trace_events.append({'name': '{} {}'.format(event['cache'], 'hit' if event['hit'] else 'miss'),
+                                     'cat': 'cache', 'ph': 'i', 's': 'g', 'pid': 1,
+                                     'tid': self.thread(threads, 'cache'),
+                                     'ts': (event['time'] - origin) * 1e6, 'args': {'target': event['target']}})
+        for name, tid in threads.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def thread(self, threads, name):
+        if name not in threads:
+            threads[name] = len(threads) + 1
+        return threads[name]
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+class Summary:
+    """
+    Collects events and summarizes the build: critical path, cache hit rate and the slowest targets
+    """
+    def __init__(self):
+        self.targets = {}
+        self.dependencies = {}
+        self.cache = {}
+        self.processes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            if event['kind'] == 'target_start':
+                self.dependencies[event['target']] = event['dependencies']
+            elif event['kind'] == 'target_finish':
+                self.targets[event['target']] = event
+            elif event['kind'] == 'cache':
+                hits, total = self.cache.get(event['cache'], (0, 0))
+                self.cache[event['cache']] = (hits + int(event['hit']), total + 1)
+            elif event['kind'] == 'exit':
+                self.processes.append(event)
+
+    def critical_path(self):
+        """
+        :return: the longest chain of dependent targets by assembly duration and its total duration
+        """
+        paths = {}
+
+        def longest(name):
+            if name not in paths:
+                best = ([], 0)
+                for dependency in self.dependencies.get(name, []):
+                    if dependency in self.targets:
+                        best = max(best, longest(dependency), key=lambda p: p[1])
+                duration = self.targets[name]['duration']
+                paths[name] = (best[0] + [name], best[1] + duration)
+            return paths[name]
+
+        result = ([], 0)
+        for name in self.targets:
+            result = max(result, longest(name), key=lambda p: p[1])
+        return result
+
+    def hit_rate(self):
+        """
+        :return: share of targets which weren't compiled, or None if there were no targets
+        """
+        if len(self.targets) == 0:
+            return None
+        hits = sum(1 for e in self.targets.values() if e['status'] in ('cached', 'restored'))
+        return hits / len(self.targets)
+
+    def slowest(self, count=10):
+        return sorted(self.targets.values(), key=lambda e: -e['duration'])[:count]
+
+    def report(self, count=10):
+        lines = []
+        path, duration = self.critical_path()
+        lines.append("Critical path ({:.3f}s): {}".format(duration, ' -> '.join(path)))
+        hit_rate = self.hit_rate()
+        if hit_rate is not None:
+            lines.append("Cache hit rate: {:.1%} of {} targets".format(hit_rate, len(self.targets)))
+        for cache, (hits, total) in sorted(self.cache.items()):
+            lines.append("  {}: {} hits of {} lookups".format(cache, hits, total))
+        lines.append("Slowest targets:")
+        for event in self.slowest(count):
+            lines.append("  {:<30} {:8.3f}s {}".format(event['target'], event['duration'], event['status']))
+        if self.processes:
+            peak = max(self.processes, key=lambda e: e['max_rss'] or 0)
+            if peak['max_rss']:
+                lines.append("Peak process memory: {:.1f} MiB ({})".format(
+                    peak['max_rss'] / 1024 ** 2, ' '.join(peak['command'])))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def trace(path):
+    """
+    Writes Chrome trace of everything happened in the block to path
+    """
+    chrome_trace = ChromeTrace()
+    with listening(chrome_trace):
+        try:
+            yield chrome_trace
+        finally:
+            chrome_trace.save(path)
@@ -0,0 +1,140 @@
+"""
+Explanation of cache misses. Every built target keeps the components its hash is made of: sources, headers,
+include and library paths, libraries, options, optimization level, entry point and hashes of dependencies. When a
+target is built again, the components changed since its last successful build are kept in interstate, so one can
+see why it wasn't loaded from cache. Changes are rolled up across the graph to the components that caused them.
+"""
+
+import megazord
+
+# Dependents of a pending early cutoff target are rebuilt only if its output changes
+PENDING = 'pending, decided by output fingerprint'
+
+
+def diff(old, new):
+    """
+    :param old: list of (component, fingerprint) of the last successful build or None
+    :param new: list of (component, fingerprint) of the current state
+    :return: list of (component, kind) where kind is 'changed', 'added' or 'removed'
+    """
+    old = dict(old)
+    new = dict(new)
+    result = [(component, 'changed') for component in new if component in old and old[component] != new[component]]
+    result.extend((component, 'added') for component in new if component not in old)
+    result.extend((component, 'removed') for component in old if component not in new)
+    return result
+
+
+def dependency(component):
+    """
+    :return: name of the dependency the component stands for or None
+    """
+    return component[len('dependency:'):] if component.startswith('dependency:') else None
+
+
+def changes(target, forced=None):
+    """
+    :param forced: effective forced flag of the target
+    :return: list of (component, kind) why the target has to be built, empty if it is up to date
+    """
+    storage = megazord.interstate.target_storage[target.name]
+    if storage['hash'] is None:
+        return [('target', 'never built')]
+    result = []
+    if forced:
+        result.append(('target', 'forced'))
+    if not megazord.system.exists(target.output_dir + target.output):
+        result.append(('output', 'missing'))
+    if storage['hash'] != target.hash():
+        if storage['components'] is None:
+            # Built by a version of megazord which didn't keep components
+            result.append(('target', 'unknown'))
+        else:
+            result.extend(diff(storage['components'], target.components()))
+    return result
+
+
+def explain(root, forced=None):
+    """
+    Tells which targets of the graph the next assembly builds and why, without building anything
+    :param root: root Target
+    :param forced: forced flag for the root target. Override class variable.
+    :return: dict {target name: list of (component, kind)} of targets which have to be built. Dependents of
+    early cutoff targets which have to be built are listed with kind PENDING, they may stay cached.
+    """
+    order, forces = megazord.scheduler.collect(root, forced)
+    for target in order:
+        target.hashes = {}
+        target.resolve()
+    explanation = {}
+    # Targets which are built only if outputs of early cutoff targets change
+    uncertain = set()
+    for target in order:
+        pending = set(current.name for current in target.dependencies if current.name in uncertain or
+                      current.early_cutoff is not None and current.name in explanation)
+        reasons = [(component, PENDING if kind == 'changed' and dependency(component) in pending else kind)
+                   for component, kind in changes(target, forces[target])]
+        if reasons:
+            explanation[target.name] = reasons
+            if all(kind == PENDING for _, kind in reasons):
+                uncertain.add(target.name)
+    return explanation
+
+
+def last():
+    """
+    :return: dict {target name: list of (component, kind)} of targets built by the last assembly of each of them
+    """
+    return {name: info['rebuild'] for name, info in megazord.interstate.target_storage.load().items()
+            if info.get('rebuild')}
+
+
+def causes(explanation):
+    """
+    Rolls changes up across the graph: a target rebuilt because a rebuilt dependency changed is attributed to
+    the changes of that dependency
+    :param explanation: dict {target name: list of (component, kind)}
+    :return: dict {(target name, component, kind): sorted list of names of targets rebuilt because of it}
+    """
+    roots = {}
+
+    def visit(name, visiting):
+        if name in roots:
+            return roots[name]
+        result = set()
+        for component, kind in explanation[name]:
+            name_of_dependency = dependency(component)
+            if name_of_dependency in explanation and name_of_dependency not in visiting:
+                result |= visit(name_of_dependency, visiting | {name})
+            else:
+                result.add((name, component, kind))
+        roots[name] = result
+        return result
+
+    rolled = {}
+    for name in explanation:
+        for cause in visit(name, frozenset()):
+            rolled.setdefault(cause, []).append(name)
+    return {cause: sorted(names) for cause, names in rolled.items()}
+
+
+def report(explanation):
+    """
+    :param explanation: dict {target name: list of (component, kind)}
+    :return: human-readable report, one line per target and per root cause
+    """
+    if not explanation:
+        return 'All targets are up to date'
+    pending = [name for name, reasons in explanation.items() if all(kind == PENDING for _, kind in reasons)]
+    if pending:
+        lines = ['{} targets rebuilt, {} more if outputs change:'.format(len(explanation) - len(pending), len(pending))]
+    else:
+        lines = ['{} targets rebuilt:'.format(len(explanation))]
+    for name, reasons in sorted(explanation.items()):
+        lines.append('  {}: {}'.format(name, ', '.join('{} {}'.format(component, kind)
+                                                      for component, kind in reasons)))
+    lines.append('Root causes:')
+    rolled = sorted(causes(explanation).items(), key=lambda item: (-len(item[1]), item[0]))
+    for (name, component, kind), names in rolled:
+        lines.append('  {} {} {} -> {} targets: {}'.format(name, component, kind, len(names), ', '.join(names)))
+    return '\n'.join(lines)
@@ -4,64 +4,214 @@ Interstate stores caching data in .megazord subfolder
 
 import os
 import pickle
+import sqlite3
+import threading
+import contextlib
 import megazord
 
 
+root_path = None
+# Entries marking the root of a repository, the root of the project isn't looked for above it
+VCS_DIRS = ('.git', '.hg', '.svn')
+
+
 def clear():
     destroy()
     init()
 
 
 def destroy():
-    megazord.system.rm('.megazord')
+    target_storage.close()
+    megazord.system.rm(mzdir(''))
 
 
 def init():
     if is_init():
         raise FileExistsError('Megazord already initialized')
     else:
-        megazord.system.mkdir_p('.megazord')
-        megazord.system.mkdir_p('.megazord/targets')
+        megazord.system.mkdir_p(mzdir(''))
+        megazord.system.mkdir_p(mzdir('targets'))
+
+
+def ensure():
+    if not is_init():
+        init()
 
 
 def is_init():
-    return megazord.system.exists('.megazord')
+    return megazord.system.exists(mzdir(''))
+
+
+def discover(path=None):
+    """
+    :return: the closest directory containing .megazord among path (current directory by default) and its
+    parents up to the root of the repository (the closest one with .git, .hg or .svn). Outside of repositories
+    only path itself is checked, so a stray .megazord in a home or a temporary directory isn't shared by unrelated
+    projects. If there is no one, returns path itself.
+    """
+    path = os.path.abspath(path or os.getcwd())
+    current = path
+    candidate = None
+    while True:
+        if candidate is None and os.path.isdir(os.path.join(current, '.megazord')):
+            candidate = current
+        if any(os.path.exists(os.path.join(current, vcs)) for vcs in VCS_DIRS):
+            return candidate or path
+        parent = os.path.dirname(current)
+        if parent == current:
+            return path
+        current = parent
+
+
+def set_root(path):
+    """
+    Sets project root explicitly, interstate will be kept in path/.megazord
+    """
+    global root_path
+    target_storage.close()
+    root_path = os.path.abspath(path)
+
+
+def root():
+    """
+    :return: project root. It is $MEGAZORD_ROOT, set by set_root() or discovered on first use
+    """
+    global root_path
+    if root_path is None:
+        root_path = os.path.abspath(os.environ['MEGAZORD_ROOT']) if 'MEGAZORD_ROOT' in os.environ else discover()
+    return root_path
 
 
 def mzdir(path):
-    return ".megazord/{}".format(path)
+    return os.path.join(root(), '.megazord', path)
+
+
+class PickleBackend:
+    """
+    Stores every target and object in its own pickle file
+    """
+    def load_targets(self):
+        targets = {}
+        if megazord.system.exists(mzdir('targets')):
+            for name in os.listdir(mzdir('targets')):
+                targets[name] = self.load_object("{}/{}".format('targets', name))
+        return targets
+
+    def save_targets(self, targets):
+        for name, info in targets.items():
+            self.save_object("{}/{}".format('targets', name), info)
+
+    def load_object(self, path):
+        if not megazord.system.exists(mzdir(path)):
+            return None
+        with open(mzdir(path), "rb") as f:
+            return pickle.load(f)
+
+    def save_object(self, path, obj):
+        ensure()
+        megazord.system.mkdir_p(os.path.dirname(mzdir(path)))
+        with open(mzdir(path), "wb+") as f:
+            pickle.dump(obj, f)
+
+    def close(self):
+        pass
+
+
+class SqliteBackend:
+    """
+    Stores all targets and objects in the single SQLite database in WAL mode, every save is atomic
+    """
+    def __init__(self, path='state.db'):
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.connection is None:
+            ensure()
+            self.connection = sqlite3.connect(mzdir(self.path), check_same_thread=False, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS targets (name TEXT PRIMARY KEY, info BLOB)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS objects (path TEXT PRIMARY KEY, value BLOB)')
+        return self.connection
+
+    def load_targets(self):
+        with self.lock:
+            rows = self.connect().execute('SELECT name, info FROM targets').fetchall()
+        targets = {name: pickle.loads(info) for name, info in rows}
+        if len(targets) == 0:
+            # Import state written by the previous versions
+            targets = PickleBackend().load_targets()
+            if len(targets) > 0:
+                self.save_targets(targets)
+        return targets
+
+    def save_targets(self, targets):
+        rows = [(name, pickle.dumps(info)) for name, info in targets.items()]
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany('INSERT OR REPLACE INTO targets (name, info) VALUES (?, ?)', rows)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def load_object(self, path):
+        with self.lock:
+            row = self.connect().execute('SELECT value FROM objects WHERE path = ?', (path,)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def save_object(self, path, obj):
+        with self.lock:
+            self.connect().execute('INSERT OR REPLACE INTO objects (path, value) VALUES (?, ?)',
+                                   (path, pickle.dumps(obj)))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+backends = {'pickle': PickleBackend, 'sqlite': SqliteBackend}
+
+
+def set_backend(name):
+    """
+    Changes storage backend of interstate
+    :param name: 'sqlite' (default) or 'pickle'
+    """
+    if name not in backends:
+        raise ValueError("Unknown interstate backend {}".format(name))
+    target_storage.close()
+    target_storage.backend = backends[name]()
 
 
 def load_object(path):
-    if not megazord.system.exists(mzdir(path)):
-        return None
-    else:
-        f = open(mzdir(path), "rb")
-        result = pickle.load(f)
-    return result
+    return target_storage.backend.load_object(path)
 
 
 def save_object(path, obj):
-    with open(mzdir(path), "wb+") as f:
-        result = pickle.dump(obj, f)
-    return result
+    return target_storage.backend.save_object(path, obj)
 
 
 def load_target_info(name):
-    return load_object("{}/{}".format('targets', name))
+    return target_storage.load()[name] if name in target_storage.load() else None
 
 
 def save_target_info(name, obj):
-    return save_object("{}/{}".format('targets', name), obj)
+    target_storage.load()[name] = obj
+    target_storage.changed(name)
 
 
 class TargetInfo:
-    def __init__(self, name):
+    def __init__(self, name, storage=None):
         self.name = name
-        self.target_info = load_target_info(self.name)
-        if self.target_info is None:
-            save_target_info(self.name, {})
-            self.target_info = {}
+        self.storage = storage or target_storage
+        self.target_info = self.storage.load().setdefault(name, {})
 
     def __getitem__(self, index):
         if index not in self.target_info:
@@ -70,14 +220,69 @@ class TargetInfo:
             return self.target_info[index]
 
     def __setitem__(self, index, value):
-        self.target_info[index] = value
-        save_target_info(self.name, self.target_info)
+        with self.storage.lock:
+            self.target_info[index] = value
+            self.storage.changed(self.name)
 
 
 class TargetStorage:
+    """
+    Loads state of all targets with one read and writes changed targets back. Inside transaction() changes
+    are written once at the end of it, otherwise every change is written immediately.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend or SqliteBackend()
+        self.targets = None
+        self.dirty = set()
+        self.depth = 0
+        self.lock = threading.RLock()
+
+    def load(self):
+        if self.targets is None:
+            with self.lock:
+                if self.targets is None:
+                    self.targets = self.backend.load_targets()
+        return self.targets
+
+    def changed(self, name):
+        with self.lock:
+            self.dirty.add(name)
+            if self.depth == 0:
+                self.commit()
+
+    def commit(self):
+        with self.lock:
+            if len(self.dirty) > 0:
+                self.backend.save_targets({name: dict(self.targets[name]) for name in self.dirty})
+                self.dirty = set()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.commit()
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.backend.close()
+            self.targets = None
+
     def __getitem__(self, index):
-        return TargetInfo(index)
+        return TargetInfo(index, self)
 
-if not is_init():
-    init()
-target_storage = TargetStorage()
\ No newline at end of file
+
+def transaction():
+    """
+    Batches all interstate writes until the end of the block and commits them atomically
+    """
+    return target_storage.transaction()
+
+
+target_storage = TargetStorage()
@@ -0,0 +1,165 @@
+"""
+In-process writer of JAR files. Entries are written in sorted order with fixed timestamps and permissions, so
+the same classes always give a byte-identical JAR. If the previous JAR is still the one written by megazord,
+compressed data of unchanged entries is copied from it instead of being compressed again.
+"""
+
+import os
+import zlib
+import struct
+import zipfile
+import megazord
+
+# 1980-01-01 00:00:00 is the earliest moment representable in ZIP
+DOS_TIME = 0
+DOS_DATE = (1 << 5) | 1
+FILE_ATTRIBUTES = 0o100644 << 16
+DIRECTORY_ATTRIBUTES = (0o40755 << 16) | 0x10
+# Files are marked as created on Unix to make permissions meaningful
+VERSION_MADE_BY = (3 << 8) | 20
+VERSION_NEEDED = 20
+MANIFEST = 'META-INF/MANIFEST.MF'
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+
+states = None
+
+
+def load():
+    global states
+    if states is None:
+        states = megazord.interstate.load_object('jars') or {}
+    return states
+
+
+def save():
+    megazord.interstate.save_object('jars', states)
+
+
+def manifest(entry_point=None):
+    lines = ['Manifest-Version: 1.0', 'Created-By: megazord']
+    if entry_point is not None:
+        lines.append('Main-Class: {}'.format(entry_point.replace('/', '.')))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+
+def directories(names):
+    result = set()
+    for name in names:
+        parts = name.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            result.add('/'.join(parts[:i]) + '/')
+    return result
+
+
+def deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def entry(name, data):
+    """
+    :return: (name, method, crc, compressed data, size) of the new entry
+    """
+    if name.endswith('/'):
+        return name, zipfile.ZIP_STORED, 0, b'', 0
+    return name, zipfile.ZIP_DEFLATED, zlib.crc32(data), deflate(data), len(data)
+
+
+def read_entries(path, names):
+    """
+    :return: dict {name: entry} with compressed data of names copied from the JAR
+    """
+    result = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.filename not in names:
+                continue
+            f.seek(info.header_offset)
+            header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+            f.seek(header[9] + header[10], os.SEEK_CUR)
+            result[info.filename] = (info.filename, info.compress_type, info.CRC, f.read(info.compress_size),
+                                     info.file_size)
+    return result
+
+
+def write_entries(f, entries):
+    central = []
+    for name, method, crc, data, size in entries:
+        encoded = name.encode('utf-8')
+        flags = 0 if name.isascii() else 0x800
+        offset = f.tell()
+        f.write(LOCAL_HEADER.pack(0x04034b50, VERSION_NEEDED, flags, method, DOS_TIME, DOS_DATE, crc, len(data), size,
+                                  len(encoded), 0))
+        f.write(encoded)
+        f.write(data)
+        attributes = DIRECTORY_ATTRIBUTES if name.endswith('/') else FILE_ATTRIBUTES
+        central.append(CENTRAL_HEADER.pack(0x02014b50, VERSION_MADE_BY, VERSION_NEEDED, flags, method, DOS_TIME,
+                                           DOS_DATE, crc, len(data), size, len(encoded), 0, 0, 0, 0, attributes,
+                                           offset) + encoded)
+    start = f.tell()
+    for header in central:
+        f.write(header)
+    f.write(END_RECORD.pack(0x06054b50, 0, 0, len(entries), len(entries), f.tell() - start, start, 0))
+
+
+def stat(path):
+    try:
+        s = os.stat(path)
+        return s.st_size, s.st_mtime_ns
+    except OSError:
+        return None
+
+
+def write(path, files, entry_point=None):
+    """
+    Writes JAR with the manifest and the files
+    :param path: path of the JAR
+    :param files: dict {name of the entry: path of the file}, i.e. {'com/example/Board.class': 'bin/com/...'}
+    :param entry_point: main class of the JAR, i.e. 'com.example.Board'
+    :return: True if the JAR was written, False if it was up to date
+    """
+    if len(files) + 2 > 0xffff:
+        raise ValueError("Too many entries for JAR without ZIP64 support: {}".format(len(files)))
+    names = sorted(files)
+    digests = dict(zip(names, megazord.utils.digests([files[name] for name in names])))
+    digests[MANIFEST] = manifest(entry_point).decode('utf-8')
+    key = os.path.abspath(path)
+    state = load().get(key)
+    valid = state is not None and state['stat'] == stat(path)
+    if valid and state['entries'] == digests:
+        return False
+    reused = {}
+    if valid:
+        unchanged = {name for name, digest in digests.items() if state['entries'].get(name) == digest}
+        try:
+            reused = read_entries(path, unchanged)
+        except (OSError, zipfile.BadZipFile, struct.error):
+            reused = {}
+
+    entries = []
+    for name in ['META-INF/', MANIFEST] + sorted(directories(names) - {'META-INF/'}) + names:
+        if name in reused:
+            entries.append(reused[name])
+        elif name == MANIFEST:
+            entries.append(entry(name, manifest(entry_point)))
+        elif name.endswith('/'):
+            entries.append(entry(name, b''))
+        else:
+            with open(files[name], 'rb') as f:
+                entries.append(entry(name, f.read()))
+    tmp_file = megazord.system.mkstemp(os.path.dirname(key))
+    try:
+        with open(tmp_file, 'wb') as f:
+            write_entries(f, entries)
+        os.chmod(tmp_file, 0o644)
+        os.replace(tmp_file, key)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    load()[key] = {'stat': stat(key), 'entries': digests}
+    save()
+    return True
@@ -0,0 +1,364 @@
+"""
+Warm compile server for JavaCompiler. A small helper runs javac in-process through javax.tools, so the JVM
+startup and JIT warmup are paid once instead of on every compilation. The helper talks to megazord over
+stdin/stdout, compiles requests concurrently and exits on its own after idle_timeout seconds without requests
+or when megazord exits. JavaCompiler falls back to spawning javac whenever the server is unavailable.
+"""
+
+import os
+import sys
+import time
+import struct
+import asyncio
+import hashlib
+import tempfile
+import itertools
+import threading
+import subprocess
+import concurrent.futures
+import megazord
+
+MAGIC = 0x4d5a4a43
+HELPER_CLASS = 'MegazordJavacServer'
+HELPER_SOURCE = r'''
+import java.io.*;
+import java.nio.charset.StandardCharsets;
+import java.util.concurrent.*;
+import javax.tools.*;
+
+public class MegazordJavacServer {
+    private static final Object lock = new Object();
+    private static int running = 0;
+    private static long last = System.currentTimeMillis();
+
+    private static String readString(DataInputStream in) throws IOException {
+        byte[] data = new byte[in.readInt()];
+        in.readFully(data);
+        return new String(data, StandardCharsets.UTF_8);
+    }
+
+    public static void main(String[] args) throws Exception {
+        final long idle = Long.parseLong(args[0]) * 1000;
+        final JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        final DataOutputStream out = new DataOutputStream(
+                new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+        DataInputStream in = new DataInputStream(new BufferedInputStream(new FileInputStream(FileDescriptor.in)));
+        // Nothing but responses may be written to stdout, i.e. by annotation processors
+        System.setOut(System.err);
+        if (compiler == null) {
+            System.err.println("javax.tools compiler is not available");
+            System.exit(1);
+        }
+        out.writeInt(0x4d5a4a43);
+        out.flush();
+
+        Thread watchdog = new Thread(() -> {
+            while (true) {
+                try {
+                    Thread.sleep(1000);
+                } catch (InterruptedException e) {
+                    return;
+                }
+                synchronized (lock) {
+                    if (running == 0 && System.currentTimeMillis() - last > idle) {
+                        System.exit(0);
+                    }
+                }
+            }
+        });
+        watchdog.setDaemon(true);
+        watchdog.start();
+
+        ExecutorService pool = Executors.newCachedThreadPool(r -> {
+            Thread thread = new Thread(r);
+            thread.setDaemon(true);
+            return thread;
+        });
+        while (true) {
+            final int id;
+            final String[] compilerArgs;
+            try {
+                id = in.readInt();
+                synchronized (lock) {
+                    running++;
+                }
+                compilerArgs = new String[in.readInt()];
+                for (int i = 0; i < compilerArgs.length; i++) {
+                    compilerArgs[i] = readString(in);
+                }
+            } catch (EOFException e) {
+                System.exit(0);
+                return;
+            }
+            pool.execute(() -> {
+                ByteArrayOutputStream stdout = new ByteArrayOutputStream();
+                ByteArrayOutputStream stderr = new ByteArrayOutputStream();
+                int code;
+                try {
+                    code = compiler.run(null, stdout, stderr, compilerArgs);
+                } catch (Throwable e) {
+                    e.printStackTrace(new PrintStream(stderr));
+                    code = 3;
+                }
+                try {
+                    synchronized (out) {
+                        out.writeInt(id);
+                        out.writeInt(code);
+                        out.writeInt(stdout.size());
+                        out.writeInt(stderr.size());
+                        stdout.writeTo(out);
+                        stderr.writeTo(out);
+                        out.flush();
+                    }
+                } catch (IOException e) {
+                    System.exit(0);
+                } finally {
+                    synchronized (lock) {
+                        running--;
+                        last = System.currentTimeMillis();
+                    }
+                }
+            });
+        }
+    }
+}
+'''
+
+idle = None
+servers = {}
+broken = set()
+lock = threading.Lock()
+
+
+class Unavailable(Exception):
+    pass
+
+
+def enable(idle_timeout=300):
+    """
+    Enables compile server for all JavaCompilers
+    :param idle_timeout: seconds without requests after which the server exits
+    """
+    global idle
+    idle = idle_timeout
+
+
+def disable():
+    """
+    Disables compile server and stops running servers
+    """
+    global idle
+    idle = None
+    with lock:
+        running = list(servers.values())
+        servers.clear()
+        broken.clear()
+    for server in running:
+        server.close()
+
+
+def enabled():
+    return idle is not None
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError()
+    return data
+
+
+def java(javac):
+    """
+    :return: java binary of the same JDK as javac
+    """
+    sibling = os.path.join(os.path.dirname(os.path.realpath(megazord.toolchain.which(javac))), 'java')
+    if os.path.isfile(sibling):
+        return sibling
+    return megazord.toolchain.which('java')
+
+
+def helper(javac):
+    """
+    Compiles the helper with javac once
+    :return: directory with the compiled helper
+    """
+    real_path = os.path.realpath(megazord.toolchain.which(javac))
+    stat = os.stat(real_path)
+    key = hashlib.sha1('{}:{}:{}:{}'.format(real_path, stat.st_size, stat.st_mtime_ns, HELPER_SOURCE)
+                       .encode('utf-8')).hexdigest()[:16]
+    directory = megazord.interstate.mzdir(os.path.join('javaserver', key))
+    if os.path.isfile(os.path.join(directory, HELPER_CLASS + '.class')):
+        return directory
+    megazord.system.mkdir_p(os.path.dirname(directory))
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(directory))
+    try:
+        source = os.path.join(tmp_dir, HELPER_CLASS + '.java')
+        with open(source, 'w') as f:
+            f.write(HELPER_SOURCE)
+        subprocess.check_output([javac, '-d', tmp_dir, source], stderr=subprocess.STDOUT)
+        os.remove(source)
+        os.replace(tmp_dir, directory)
+    except (OSError, subprocess.CalledProcessError) as e:
+        megazord.system.rm(tmp_dir)
+        if os.path.isfile(os.path.join(directory, HELPER_CLASS + '.class')):
+            return directory
+        raise Unavailable("Compile server can't be built: {}".format(e))
+    return directory
+
+
+class Server:
+    def __init__(self, javac):
+        self.javac = javac
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count()
+        self.closed = False
+        self.process = None
+        binary = java(javac)
+        if binary is None:
+            raise Unavailable("java was not found")
+        try:
+            self.process = subprocess.Popen([binary, '-cp', helper(javac), HELPER_CLASS, str(idle)],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            magic, = struct.unpack('>I', read_exactly(self.process.stdout, 4))
+        except (OSError, EOFError) as e:
+            self.close()
+            raise Unavailable("Compile server failed to start: {}".format(e))
+        if magic != MAGIC:
+            self.close()
+            raise Unavailable("Compile server failed to start")
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def submit(self, args):
+        """
+        :return: concurrent.futures.Future resolved to (returncode, stdout, stderr)
+        """
+        request = [struct.pack('>ii', 0, len(args))]
+        for arg in args:
+            encoded = arg.encode('utf-8')
+            request.append(struct.pack('>i', len(encoded)) + encoded)
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise Unavailable("Compile server exited")
+            request_id = next(self.ids)
+            request[0] = struct.pack('>ii', request_id, len(args))
+            self.pending[request_id] = future
+            try:
+                self.process.stdin.write(b''.join(request))
+                self.process.stdin.flush()
+            except OSError:
+                del self.pending[request_id]
+                self.closed = True
+                raise Unavailable("Compile server exited")
+        return future
+
+    def read(self):
+        try:
+            while True:
+                request_id, code, out_size, err_size = struct.unpack('>iiii', read_exactly(self.process.stdout, 16))
+                out = read_exactly(self.process.stdout, out_size)
+                err = read_exactly(self.process.stdout, err_size)
+                with self.lock:
+                    future = self.pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result((code, out, err))
+        except (OSError, ValueError, EOFError, struct.error):
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+                pending, self.pending = self.pending, {}
+            for future in pending.values():
+                future.set_exception(Unavailable("Compile server exited"))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        if self.process is None:
+            return
+        if self.process.stdin is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def server(javac):
+    """
+    :return: running server for javac and the current directory, starting it if needed
+    """
+    key = (javac, os.getcwd())
+    with lock:
+        if key in broken:
+            raise Unavailable("Compile server failed to start before")
+        current = servers.get(key)
+        if current is None or current.closed:
+            try:
+                current = servers[key] = Server(javac)
+            except Unavailable:
+                broken.add(key)
+                raise
+        return current
+
+
+def finished(javac, args, start, pid, result):
+    code, out, err = result
+    if err:
+        sys.stderr.write(err.decode('utf-8', 'replace'))
+    t = [javac] + list(args)
+    # Compilations share the JVM of the server, they have no resource usage of their own
+    megazord.events.emit('exit', command=t, pid=pid, start=start, duration=time.perf_counter() - start,
+                         returncode=code, max_rss=None)
+    if code != 0:
+        raise subprocess.CalledProcessError(code, t, out)
+    return out
+
+
+def call(javac, args):
+    """
+    Compiles on the server like megazord.system.call(javac, *args) does.
+    Raises Unavailable if the server can't be used.
+    """
+    # The server might have exited being idle just before the request, so it is restarted once
+    for attempt in range(2):
+        current = server(javac)
+        if attempt == 0:
+            print("Run: {} (compile server)".format(' '.join([javac] + list(args))))
+        start = time.perf_counter()
+        try:
+            result = current.submit(args).result()
+        except Unavailable:
+            if attempt == 1:
+                raise
+            continue
+        return finished(javac, args, start, current.process.pid, result)
+
+
+async def call_async(javac, args, timeout=None):
+    """
+    Asynchronous counterpart of call(). On timeout subprocess.TimeoutExpired is raised, but the compilation
+    running on the server isn't interrupted.
+    """
+    for attempt in range(2):
+        # Starting the server compiles the helper and waits for the JVM, it doesn't run on the event loop
+        current = await megazord.aio.blocking(server, javac)
+        if attempt == 0:
+            print("Run: {} (compile server)".format(' '.join([javac] + list(args))))
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(current.submit(args)), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired([javac] + list(args), timeout)
+        except Unavailable:
+            if attempt == 1:
+                raise
+            continue
+        return finished(javac, args, start, current.process.pid, result)
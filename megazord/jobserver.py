@@ -0,0 +1,288 @@
+"""
+GNU make jobserver support. When megazord runs under `make -jN` with a jobserver (the recipe must be marked by '+'
+for the pipe form), every spawned compiler takes a token first, so the whole build doesn't run more than N
+processes. Both the fifo form of GNU make 4.4 and the pipe form are understood. megazord can also be a jobserver
+itself for the tools it launches, i.e. nested makes or megazord builds; it uses the pipe form known to every make.
+"""
+
+import os
+import shlex
+import select
+import asyncio
+import threading
+import contextlib
+import collections
+import concurrent.futures
+import megazord
+
+client = None
+server = None
+detected = False
+saved_makeflags = None
+# Takes tokens from blocking jobserver pipes for coroutines, one waiter at a time
+acquirer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='megazord-jobserver')
+
+
+class Client:
+    """
+    Takes and returns tokens of a jobserver. Every process owns one implicit token, so the first of concurrent
+    jobs doesn't wait for the jobserver.
+    """
+    def __init__(self, read_fd, write_fd, owned=False):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.owned = owned
+        self.lock = threading.Lock()
+        self.implicit = True
+        # Futures of coroutines waiting for tokens of a non-blocking jobserver, see token_async()
+        self.waiters = collections.deque()
+
+    def take(self):
+        """
+        Takes a token without waiting for it if the jobserver is non-blocking
+        :return: token to be passed to release(), None for the implicit token
+        """
+        with self.lock:
+            if self.implicit:
+                self.implicit = False
+                return None
+        token = os.read(self.read_fd, 1)
+        if not token:
+            raise EOFError("Jobserver was closed")
+        return token
+
+    def acquire(self):
+        """
+        Blocks until a token is available
+        :return: token to be passed to release(), None for the implicit token
+        """
+        while True:
+            # Other clients may take the token between select and read, a non-blocking read fails then
+            try:
+                return self.take()
+            except (BlockingIOError, InterruptedError):
+                select.select([self.read_fd], [], [])
+
+    def release(self, token):
+        if token is None:
+            with self.lock:
+                self.implicit = True
+        else:
+            os.write(self.write_fd, token)
+
+    def close(self):
+        if self.owned:
+            os.close(self.read_fd)
+            if self.write_fd != self.read_fd:
+                os.close(self.write_fd)
+
+
+class Server:
+    """
+    Jobserver pipe with jobs - 1 tokens, the last job is the implicit token of megazord
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, b'+' * (jobs - 1))
+
+    def makeflags(self):
+        return '-j{} --jobserver-auth={},{}'.format(self.jobs, self.read_fd, self.write_fd)
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def parse(makeflags):
+    """
+    :return: jobserver auth string from MAKEFLAGS ('fifo:PATH' or 'R,W') or None
+    """
+    auth = None
+    for flag in shlex.split(makeflags):
+        for option in ('--jobserver-auth=', '--jobserver-fds='):
+            if flag.startswith(option):
+                # The last one wins like in make
+                auth = flag[len(option):]
+    return auth
+
+
+def valid_fd(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def connect(makeflags):
+    """
+    :return: Client of the jobserver from MAKEFLAGS or None if there is none or it isn't accessible
+    """
+    auth = parse(makeflags)
+    if auth is None:
+        return None
+    if auth.startswith('fifo:'):
+        try:
+            fd = os.open(auth[len('fifo:'):], os.O_RDWR | os.O_NONBLOCK)
+        except OSError as e:
+            megazord.system.warning("Jobserver {} can't be opened: {}".format(auth, e))
+            return None
+        return Client(fd, fd, owned=True)
+    try:
+        read_fd, write_fd = map(int, auth.split(','))
+    except ValueError:
+        megazord.system.warning("Unknown jobserver {}".format(auth))
+        return None
+    if read_fd < 0 or not valid_fd(read_fd) or not valid_fd(write_fd):
+        megazord.system.warning("Jobserver pipe isn't inherited, mark the recipe by '+' to share make's jobs")
+        return None
+    return Client(read_fd, write_fd)
+
+
+def current():
+    """
+    :return: Client of the jobserver megazord runs under or serves, detected from MAKEFLAGS once
+    """
+    global client, detected
+    if not detected:
+        detected = True
+        client = connect(os.environ.get('MAKEFLAGS', ''))
+    return client
+
+
+def serve(jobs):
+    """
+    Bounds processes spawned by megazord and by tools it launches with jobs, unless megazord already runs under
+    a jobserver that bounds them
+    :param jobs: number of jobs of the whole build
+    :return: returns Client
+    """
+    global client, server, saved_makeflags
+    if current() is not None:
+        return client
+    if jobs < 1:
+        raise ValueError("Jobserver needs at least one job")
+    server = Server(jobs)
+    saved_makeflags = os.environ.get('MAKEFLAGS')
+    # Tools launched by megazord are clients of the server
+    flags = [flag for flag in shlex.split(saved_makeflags or '')
+             if not flag.startswith(('-j', '--jobs', '--jobserver-auth=', '--jobserver-fds='))]
+    os.environ['MAKEFLAGS'] = ' '.join([server.makeflags()] + [shlex.quote(flag) for flag in flags])
+    client = Client(server.read_fd, server.write_fd)
+    return client
+
+
+def disable():
+    """
+    Stops using the jobserver and stops the server started by serve()
+    """
+    global client, server, detected, saved_makeflags
+    if client is not None:
+        client.close()
+    if server is not None:
+        server.close()
+        if saved_makeflags is None:
+            os.environ.pop('MAKEFLAGS', None)
+        else:
+            os.environ['MAKEFLAGS'] = saved_makeflags
+    client = server = saved_makeflags = None
+    detected = True
+
+
+def inherited():
+    """
+    :return: file descriptors spawned processes inherit to be clients of the same jobserver
+    """
+    jobserver = current()
+    if jobserver is None or jobserver.owned:
+        return ()
+    return jobserver.read_fd, jobserver.write_fd
+
+
+@contextlib.contextmanager
+def token():
+    """
+    Holds a jobserver token, if there is a jobserver, while the block runs
+    """
+    jobserver = current()
+    if jobserver is None:
+        yield
+        return
+    taken = jobserver.acquire()
+    try:
+        yield
+    finally:
+        jobserver.release(taken)
+
+
+def serve_waiters(jobserver, loop):
+    """
+    Hands tokens of a non-blocking jobserver to waiting coroutines of the loop in order, stops watching the
+    jobserver when nobody waits
+    """
+    while jobserver.waiters:
+        future = jobserver.waiters[0]
+        if future.done() or future.get_loop() is not loop:
+            jobserver.waiters.popleft()
+            continue
+        try:
+            token = jobserver.take()
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, EOFError) as e:
+            token = e
+        jobserver.waiters.popleft()
+        if isinstance(token, BaseException):
+            future.set_exception(token)
+        else:
+            future.set_result(token)
+    loop.remove_reader(jobserver.read_fd)
+
+
+async def acquire_async(jobserver):
+    """
+    Waits for a token without holding a thread per waiter: non-blocking jobservers are watched by the event loop,
+    blocking pipes are read by a single dedicated thread
+    :return: token to be passed to release(), None for the implicit token
+    """
+    loop = asyncio.get_running_loop()
+    if os.get_blocking(jobserver.read_fd):
+        future = loop.run_in_executor(acquirer, jobserver.acquire)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The token taken after cancellation goes back to the jobserver
+            future.add_done_callback(lambda f: f.cancelled() or f.exception() or jobserver.release(f.result()))
+            raise
+    future = loop.create_future()
+    if not any(waiter.get_loop() is loop and not waiter.done() for waiter in jobserver.waiters):
+        loop.add_reader(jobserver.read_fd, serve_waiters, jobserver, loop)
+    jobserver.waiters.append(future)
+    serve_waiters(jobserver, loop)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        # The task may be cancelled after the token was handed to it
+        if future.done() and not future.cancelled():
+            jobserver.release(future.result())
+        raise
+
+
+@contextlib.asynccontextmanager
+async def token_async():
+    """
+    Asynchronous counterpart of token()
+    """
+    jobserver = current()
+    if jobserver is None:
+        yield
+        return
+    taken = await acquire_async(jobserver)
+    try:
+        yield
+    finally:
+        jobserver.release(taken)
+        if taken is None and jobserver.waiters:
+            # The implicit token doesn't wake the event loop up
+            serve_waiters(jobserver, asyncio.get_running_loop())
@@ -45,7 +45,7 @@ def get_tool_by_name(name):
 
 
 def get_config(name, arg, r=None):
-    result = megazord.system.call("{}-config".format(name), "--{}".format(arg))[:-1].decode("utf-8")
+    result = megazord.toolchain.config(name, arg)
     if r is not None:
         result = re.findall(r, result)
     else:
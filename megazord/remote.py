@@ -0,0 +1,307 @@
+"""
+Distributed compilation of C/C++ objects. Sources are preprocessed locally, so workers need nothing but the same
+compiler: they receive preprocessed sources over TCP, compile them and send objects back, which are linked as
+usual. Start workers by `python -m megazord worker` on other hosts (or several of them on localhost with different
+ports) and turn distribution on by megazord.remote.enable(['host:port', ...]).
+
+Workers compile anything sent by anyone who can connect to them, expose them to trusted networks only.
+"""
+
+import os
+import re
+import json
+import zlib
+import time
+import socket
+import struct
+import tempfile
+import threading
+import subprocess
+import socketserver
+import megazord
+
+DEFAULT_PORT = 4350
+COMPILERS = ['cc', 'c++', 'gcc', 'g++', 'clang', 'clang++']
+# Only flags affecting code generation are passed to workers, and none of them may read or write files: values
+# are numbers or keywords, never paths, and -Wa,/-Wp,/-Wl, passing options to other tools are refused
+ALLOWED_FLAGS = [re.compile(pattern) for pattern in (
+    r'-std=[a-z0-9+]+',
+    r'-O([0-3sgz]|fast)?',
+    r'-g([0-3]|gdb[0-3]?|dwarf(-[2-5])?)?',
+    r'-w',
+    r'-W(no-)?(error=)?[a-z0-9][a-z0-9+-]*(=[0-9]+)?',
+    r'-f(no-)?[a-zA-Z0-9][a-zA-Z0-9+-]*(=[0-9]+)?',
+    r'-f(lto|visibility|tls-model|fp-contract|sanitize|no-sanitize|sanitize-recover|cf-protection)=[a-z0-9,-]+',
+    r'-m(no-)?[a-z0-9][a-z0-9+-]*(=[a-z0-9_.+-]+)?',
+)]
+FORBIDDEN_FLAGS = ('-fplugin', '-fprofile', '-fauto-profile', '-fcreate-profile', '-fdump', '-fopt-info',
+                   '-fsave-optimization-record', '-fstack-usage', '-fcallgraph-info', '-ftest-coverage', '-fcoverage')
+MAX_HEADER_SIZE = 1024 ** 2
+
+pool = None
+
+
+class Unavailable(Exception):
+    pass
+
+
+def enable(workers, retries=2, timeout=600, cooldown=30):
+    """
+    Enables distributed compilation of objects for incremental and unity C/C++ targets. Raise object jobs of
+    targets (Target.set_incremental(jobs=N)) to keep all workers busy.
+    :param workers: list of 'host:port' or 'host' of workers
+    :param retries: number of other workers tried after a worker failed
+    :param timeout: timeout of one remote compilation in seconds
+    :param cooldown: seconds after which failed workers are checked again
+    :return: returns Pool
+    """
+    global pool
+    pool = Pool(workers, retries, timeout, cooldown)
+    return pool
+
+
+def disable():
+    global pool
+    pool = None
+
+
+def enabled():
+    return pool is not None
+
+
+def read_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 ** 2))
+        if not chunk:
+            raise EOFError()
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send(sock, header, payload=b''):
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(data)) + data + payload)
+
+
+def receive(sock):
+    """
+    :return: header dict and payload bytes of the message
+    """
+    size, = struct.unpack('>I', read_exactly(sock, 4))
+    if size > MAX_HEADER_SIZE:
+        raise ValueError("Header of {} bytes is too large".format(size))
+    header = json.loads(read_exactly(sock, size).decode('utf-8'))
+    return header, read_exactly(sock, header['size'])
+
+
+def allowed(args):
+    """
+    :return: True if all arguments are flags workers may compile with, see ALLOWED_FLAGS
+    """
+    return all(any(pattern.fullmatch(arg) for pattern in ALLOWED_FLAGS) and not arg.startswith(FORBIDDEN_FLAGS)
+               for arg in args)
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            header, payload = receive(self.request)
+            send(self.request, *self.server.process(header, payload))
+        except (OSError, EOFError, ValueError, KeyError):
+            pass
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    """
+    Worker compiling preprocessed sources, at most jobs at once
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, jobs=None, compilers=None):
+        super(WorkerServer, self).__init__(address, WorkerHandler)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.compilers = compilers or COMPILERS
+        self.slots = threading.Semaphore(self.jobs)
+        self.lock = threading.Lock()
+        self.running = 0
+
+    def process(self, header, payload):
+        if header['op'] == 'ping':
+            return {'jobs': self.jobs, 'running': self.running}, b''
+        if header['op'] == 'compile':
+            return self.compile(header, payload)
+        return {'error': "Unknown operation {}".format(header['op'])}, b''
+
+    def compile(self, header, payload):
+        compiler = header['compiler']
+        if compiler not in self.compilers or megazord.toolchain.which(compiler) is None:
+            return {'error': "{} isn't available".format(compiler), 'reject': True}, b''
+        if megazord.toolchain.version(compiler) != header['version']:
+            return {'error': "{} has another version".format(compiler), 'reject': True}, b''
+        if not allowed(header['args']) or header['extension'] not in ('.i', '.ii'):
+            return {'error': "Arguments aren't allowed: {}".format(' '.join(header['args']))}, b''
+        with self.slots:
+            with self.lock:
+                self.running += 1
+            try:
+                with tempfile.TemporaryDirectory(prefix='megazord-worker-') as directory:
+                    source = os.path.join(directory, 'source' + header['extension'])
+                    obj = os.path.join(directory, 'source.o')
+                    with open(source, 'wb') as f:
+                        f.write(zlib.decompress(payload))
+                    process = subprocess.run([compiler] + header['args'] + ['-c', source, '-o', obj],
+                                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                             timeout=header.get('timeout'))
+                    output = process.stdout.decode('utf-8', 'replace')
+                    if process.returncode != 0:
+                        return {'returncode': process.returncode, 'output': output}, b''
+                    with open(obj, 'rb') as f:
+                        return {'returncode': 0, 'output': output}, zlib.compress(f.read())
+            except subprocess.TimeoutExpired:
+                return {'error': "Compilation timed out"}, b''
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT, jobs=None, compilers=None):
+    """
+    Runs worker until it is interrupted
+    :param port: port to listen, 0 to pick a free one
+    """
+    with WorkerServer((host, port), jobs, compilers) as server:
+        print("Worker listening on {}:{} with {} jobs".format(server.server_address[0], server.server_address[1],
+                                                             server.jobs), flush=True)
+        server.serve_forever()
+
+
+class Worker:
+    def __init__(self, address):
+        host, _, port = address.rpartition(':') if ':' in address else (address, None, DEFAULT_PORT)
+        self.address = (host, int(port))
+        self.jobs = 1
+        self.running = 0
+        self.healthy = False
+        self.checked = None
+        self.rejected = set()
+
+    def request(self, header, payload=b'', timeout=None):
+        with socket.create_connection(self.address, timeout) as sock:
+            send(sock, header, payload)
+            return receive(sock)
+
+    def __repr__(self):
+        return '{}:{}'.format(*self.address)
+
+
+class Pool:
+    """
+    Balances compilations between workers by their free job slots
+    """
+    def __init__(self, workers, retries=2, timeout=600, cooldown=30):
+        self.workers = [Worker(address) for address in workers]
+        self.retries = retries
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.checking = threading.Lock()
+
+    def check(self, worker):
+        """
+        Health check, failed workers aren't checked again during cooldown
+        """
+        try:
+            header, _ = worker.request({'op': 'ping'}, timeout=2)
+            worker.jobs = max(header['jobs'], 1)
+            worker.healthy = True
+        except (OSError, EOFError, ValueError, KeyError):
+            worker.healthy = False
+        worker.checked = time.monotonic()
+        return worker.healthy
+
+    def acquire(self, compiler, excluded):
+        """
+        :return: the least loaded healthy worker or None
+        """
+        candidates = [w for w in self.workers if w not in excluded and compiler not in w.rejected]
+        # Concurrent compilations wait for checks instead of checking the same workers again
+        with self.checking:
+            for worker in candidates:
+                if worker.checked is None or (not worker.healthy and time.monotonic() - worker.checked > self.cooldown):
+                    self.check(worker)
+        with self.lock:
+            healthy = [w for w in candidates if w.healthy]
+            if not healthy:
+                return None
+            worker = min(healthy, key=lambda w: w.running / w.jobs)
+            worker.running += 1
+            return worker
+
+    def release(self, worker):
+        with self.lock:
+            worker.running -= 1
+
+    def compile(self, compiler, version, args, extension, source):
+        """
+        :param source: preprocessed source
+        :return: contents of the object file
+        """
+        excluded = set()
+        for _ in range(self.retries + 1):
+            worker = self.acquire(compiler, excluded)
+            if worker is None:
+                break
+            excluded.add(worker)
+            try:
+                print("Run on {}: {} {}".format(worker, compiler, ' '.join(args)))
+                header, payload = worker.request({'op': 'compile', 'compiler': compiler, 'version': version,
+                                                  'args': args, 'extension': extension, 'timeout': self.timeout},
+                                                 zlib.compress(source), self.timeout)
+            except (OSError, EOFError, ValueError) as e:
+                megazord.system.warning("Worker {} failed: {}".format(worker, e))
+                worker.healthy = False
+                worker.checked = time.monotonic()
+                continue
+            finally:
+                self.release(worker)
+            if 'error' in header:
+                megazord.system.warning("Worker {} refused: {}".format(worker, header['error']))
+                if header.get('reject'):
+                    worker.rejected.add(compiler)
+                continue
+            if header['returncode'] != 0:
+                # Local compilation reports errors the usual way
+                raise Unavailable("Compilation failed on {}".format(worker))
+            return zlib.decompress(payload)
+        raise Unavailable("No worker is available")
+
+
+def compile(compiler, target, obj, source, args):
+    """
+    Preprocesses source locally, compiles it on a worker and writes obj and its depfile.
+    Raises Unavailable if it can't be compiled remotely.
+    """
+    if pool is None:
+        raise Unavailable("Distributed compilation is disabled")
+    args = compiler.prepare_remote_args(target).build()
+    if not allowed(args):
+        raise Unavailable("Flags of {} can't be used on workers".format(target.name))
+    extension = '.i' if os.path.splitext(source)[1] == '.c' else '.ii'
+    preprocessed = obj + extension
+    try:
+        megazord.system.call(compiler.path, *compiler.prepare_preprocess_args(target, source, obj, preprocessed)
+                             .build())
+        with open(preprocessed, 'rb') as f:
+            content = f.read()
+    finally:
+        if os.path.exists(preprocessed):
+            os.remove(preprocessed)
+    data = pool.compile(compiler.path, compiler.version(), args, extension, content)
+    tmp_file = megazord.system.mkstemp(os.path.dirname(obj))
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, obj)
@@ -0,0 +1,177 @@
+"""
+Scheduler assemblies a graph of targets, running independent targets concurrently
+"""
+
+import time
+import concurrent.futures
+import megazord
+
+
+class BuildError(Exception):
+    """
+    Raised when one or more targets failed to assemble. `failures` maps failed targets to their exceptions,
+    `skipped` lists targets which were not assembled because some of their dependencies failed.
+    """
+    def __init__(self, failures, skipped=None):
+        self.failures = failures
+        self.skipped = skipped or []
+        super(BuildError, self).__init__("Failed to assemble {}".format(
+            ', '.join(target.name for target in failures)))
+
+
+def collect(root, forced=None):
+    """
+    Walks dependency graph of the root target once
+    :param root: root Target
+    :param forced: forced flag for the root target. Override class variable.
+    :return: list of targets in dependency order and dict with effective forced flag of each target
+    """
+    order = []
+    state = {}
+    forces = {}
+
+    def visit(target, force, path):
+        if state.get(target) == 'visiting':
+            raise ValueError("Dependency cycle detected: {}".format(' -> '.join(map(str, path + [target]))))
+        if target in forces and (force != 'cascade' or forces[target] == 'cascade'):
+            # Already visited, nothing new to propagate
+            return
+        first = target not in forces
+        forces[target] = 'cascade' if target in forces else force
+        state[target] = 'visiting'
+        path.append(target)
+        for dependency in target.dependencies:
+            visit(dependency, 'cascade' if force == 'cascade' else dependency.forced, path)
+        path.pop()
+        state[target] = 'done'
+        if first:
+            order.append(target)
+
+    visit(root, root.forced if forced is None else forced, [])
+    return order, forces
+
+
+class Scheduler:
+    """
+    Runs assembly of every target in the graph exactly once, respecting dependencies. Ready targets on the
+    longest remaining path, by durations of their previous builds, are started first.
+    """
+    def __init__(self, jobs=1, keep_going=False, memory=None):
+        """
+        :param jobs: number of targets assembled concurrently (like make -j)
+        :param keep_going: continue assembling targets that don't depend on a failed one (like make -k)
+        :param memory: budget in bytes for memory of processes of concurrently assembled targets, a target
+        exceeding it on its own is assembled alone. Unlimited by default.
+        """
+        if jobs is None or jobs < 1:
+            jobs = 1
+        self.jobs = jobs
+        self.keep_going = keep_going
+        self.memory = memory
+
+    def run(self, root, forced=None, rehash=True):
+        """
+        Assemblies root target with all its dependencies
+        :param root: Target
+        :param forced: forced rebuild even if cached version is presented. Override class variable.
+        :param rehash: drop memoized hashes of all targets, megazord.watch drops only hashes of changed ones
+        :return: returns root
+        """
+        order, forces = collect(root, forced)
+        if rehash and megazord.snapshot.up_to_date(order, forces):
+            return root
+        if rehash:
+            for target in order:
+                target.hashes = {}
+        started = time.time_ns()
+        try:
+            with megazord.interstate.transaction():
+                self.assembly(root, order, forces)
+        finally:
+            megazord.utils.file_hash_cache.save()
+        megazord.snapshot.record(order, started)
+        return root
+
+    def admissible(self, ready, running, memory):
+        """
+        :return: the first ready target whose memory fits into the budget together with running targets or None
+        """
+        used = sum(memory[target] for target in running.values())
+        for target in ready:
+            if self.memory is None or not running or used + memory[target] <= self.memory:
+                return target
+        return None
+
+    def assembly(self, root, order, forces):
+        index = {target: i for i, target in enumerate(order)}
+        priorities = megazord.costs.priorities(order)
+        memory = {target: megazord.costs.memory(target) for target in order}
+        waiting = {target: len(set(target.dependencies)) for target in order}
+        dependents = {target: [] for target in order}
+        for target in order:
+            for dependency in set(target.dependencies):
+                dependents[dependency].append(target)
+
+        def urgency(target):
+            return -priorities[target], index[target]
+
+        ready = sorted((target for target in order if waiting[target] == 0), key=urgency)
+        failures = {}
+        skipped = []
+
+        def finished(target):
+            for dependent in dependents[target]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+            ready.sort(key=urgency)
+
+        def failed(target, exc):
+            failures[target] = exc
+            stack = list(dependents[target])
+            while stack:
+                dependent = stack.pop()
+                if dependent not in skipped:
+                    skipped.append(dependent)
+                    stack.extend(dependents[dependent])
+
+        if self.jobs == 1:
+            while ready:
+                target = ready.pop(0)
+                if target in skipped:
+                    continue
+                try:
+                    target.assembly_self(forced=forces[target])
+                except Exception as exc:
+                    if not self.keep_going:
+                        raise
+                    failed(target, exc)
+                else:
+                    finished(target)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                running = {}
+                while ready or running:
+                    ready[:] = [target for target in ready if target not in skipped]
+                    while ready and len(running) < self.jobs and (self.keep_going or not failures):
+                        target = self.admissible(ready, running, memory)
+                        if target is None:
+                            break
+                        ready.remove(target)
+                        running[executor.submit(target.assembly_self, forces[target])] = target
+                    if not running:
+                        break
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        target = running.pop(future)
+                        exc = future.exception()
+                        if exc is not None:
+                            failed(target, exc)
+                        else:
+                            finished(target)
+            if failures and not self.keep_going:
+                raise next(iter(failures.values()))
+
+        if failures:
+            raise BuildError(failures, skipped)
+        return root
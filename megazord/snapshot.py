@@ -0,0 +1,153 @@
+"""
+Snapshot of the resolved build graph for the fast no-op path. After a successful assembly every target records
+its configuration, expanded sources, language, compiler and stats of its inputs and output. The next assembly
+of the same graph compares configurations and stats only: if nothing differs, globbing, language detection,
+tool probing and hashing are skipped and all targets are up to date at once. Any difference falls back to
+the usual assembly, which records the snapshot again.
+"""
+
+import os
+import glob
+import hashlib
+import megazord
+
+# Inputs modified this close to the start of the assembly might have changed during it
+RACY_NS = 10 ** 9
+# Snapshots of other versions are ignored
+VERSION = 1
+
+def load():
+    return megazord.interstate.load_object('snapshot') or {}
+
+
+def save(snapshots):
+    megazord.interstate.save_object('snapshot', snapshots)
+
+
+def stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def compiler_key(compiler):
+    if isinstance(compiler, megazord.GenericCompiler):
+        return type(compiler).__name__, compiler.path
+    return compiler
+
+
+def configuration(target):
+    """
+    :return: fingerprint of everything configured for the target, without touching the filesystem
+    """
+    components = (os.getcwd(), target.sources_arg, target.output_dir, target.output, compiler_key(target.compiler_arg),
+                  target.entry_point, target.optimization_level, target.libraries, target.includies,
+                  target.library_paths, target.include_paths, target.options,
+                  [dependency.name for dependency in target.dependencies], target.incremental, target.unity,
+                  target.unity_size, target.unity_exclude, target.precompiled_header, target.lto, target.training,
+                  target.early_cutoff)
+    if not isinstance(target.compiler_arg, megazord.GenericCompiler):
+        # Compiler is looked up in PATH
+        components += (megazord.toolchain.environment(),)
+    return hashlib.md5(repr(components).encode('utf-8')).hexdigest()
+
+
+def glob_roots(target):
+    """
+    :return: directories whose listings determine sources of the target or None if they can't be known
+    """
+    patterns = [target.sources_arg] if isinstance(target.sources_arg, str) else target.sources_arg
+    roots = []
+    for pattern in patterns:
+        directory = os.path.dirname(pattern) or '.'
+        if glob.has_magic(directory):
+            return None
+        if glob.has_magic(pattern):
+            roots.append(directory)
+    return roots
+
+
+def inputs(target):
+    paths = list(target.sources) + target.get_headers()
+    if target.precompiled_header is not None:
+        paths.append(target.precompiled_header)
+    return paths
+
+
+def record(order, started):
+    """
+    Records snapshots of just assembled targets
+    :param started: time.time_ns() at the start of the assembly
+    """
+    snapshots = load()
+    for target in order:
+        snapshots.pop(target.name, None)
+        roots = glob_roots(target)
+        if not target.compiled or roots is None:
+            continue
+        stats = {path: stat_key(path) for path in inputs(target)}
+        roots = {root: stat_key(root) for root in roots}
+        if any(stat is None or stat[1] >= started - RACY_NS for stat in list(stats.values()) + list(roots.values())):
+            continue
+        output = target.output_dir + target.output
+        stats[output] = stat_key(output)
+        if stats[output] is None:
+            continue
+        snapshots[target.name] = {
+            'version': VERSION,
+            'configuration': configuration(target),
+            'roots': roots,
+            'stats': stats,
+            'sources': (target.sources, target.sources_names, target.sources_formats),
+            'language': target.language,
+            'compiler': compiler_key(target.compiler),
+            'hash': megazord.interstate.target_storage[target.name]['hash'],
+        }
+    save(snapshots)
+
+
+def valid(target, snapshot):
+    if snapshot is None or snapshot.get('version') != VERSION or snapshot['configuration'] != configuration(target):
+        return False
+    if snapshot['hash'] != megazord.interstate.target_storage[target.name]['hash']:
+        return False
+    for root, stat in snapshot['roots'].items():
+        if stat_key(root) != stat:
+            return False
+    for path, stat in snapshot['stats'].items():
+        if stat_key(path) != stat:
+            return False
+    return True
+
+
+def up_to_date(order, forces):
+    """
+    Marks all targets assembled if snapshots of all of them are valid
+    :return: True if nothing has to be assembled
+    """
+    if any(forces.values()):
+        return False
+    snapshots = load()
+    if not all(valid(target, snapshots.get(target.name)) for target in order):
+        return False
+    compilers = {}
+    with megazord.interstate.transaction():
+        for target in order:
+            start = target.assembly_started()
+            snapshot = snapshots[target.name]
+            if target.delayed:
+                target.sources, target.sources_names, target.sources_formats = snapshot['sources']
+                target.language = snapshot['language']
+                if isinstance(target.compiler_arg, megazord.GenericCompiler):
+                    target.compiler = target.compiler_arg
+                else:
+                    key = snapshot['compiler']
+                    if key not in compilers:
+                        compilers[key] = getattr(megazord.tools, key[0])(key[1])
+                    target.compiler = compilers[key]
+            target.mark_up_to_date('cached')
+            target.assembly_finished(start, target.status)
+    megazord.system.info("All {} targets are up to date".format(len(order)))
+    return True
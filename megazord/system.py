@@ -3,9 +3,10 @@ import os, errno
 import subprocess
 import tempfile
 import shutil
+import time
 import re
 
-from .meta import *
+import megazord
 
 def vectorizer(func):
     def vec_func(args):
@@ -24,13 +25,39 @@ setwd = os.chdir
 uname = os.uname().sysname.lower()
 
 def call(cmd, *args):
+    # Under make -jN every process takes a token of its jobserver
+    with megazord.jobserver.token():
+        return spawn(cmd, *args)
+
+
+def spawn(cmd, *args):
     t = [cmd]
     t.extend(args)
     print("Run: {}".format(' '.join(t)))
-    return subprocess.check_output(t)
+    start = time.perf_counter()
+    process = subprocess.Popen(t, stdout=subprocess.PIPE, pass_fds=megazord.jobserver.inherited())
+    megazord.costs.started()
+    megazord.events.emit('spawn', command=t, pid=process.pid)
+    max_rss = None
+    try:
+        with process.stdout:
+            output = process.stdout.read()
+        # wait4 gives resource usage of exactly this child
+        _, status, rusage = os.wait4(process.pid, 0)
+        max_rss = megazord.events.max_rss(rusage)
+    finally:
+        megazord.costs.finished(max_rss)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    megazord.events.emit('exit', command=t, pid=process.pid, start=start, duration=time.perf_counter() - start,
+                         returncode=process.returncode, max_rss=max_rss)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, t, output)
+    return output
 
 
 def mkdir_p(path):
+    if os.path.isdir(path):
+        return
     try:
         os.makedirs(path)
     except OSError as exc:  # Python >2.5
@@ -109,5 +136,16 @@ def info(text, verbose=1, *args):
 
 
 def create_symlink(file, symlink):
-    call("ln", "-sf", file, symlink)
+    """
+    Atomically replaces symlink by a symbolic link to file, like ln -sf
+    """
+    tmp_file = mkstemp(os.path.dirname(symlink) or '.')
+    os.remove(tmp_file)
+    try:
+        os.symlink(file, tmp_file)
+        os.replace(tmp_file, symlink)
+    except BaseException:
+        if os.path.lexists(tmp_file):
+            os.remove(tmp_file)
+        raise
 
@@ -2,6 +2,7 @@ import re
 import os
 import hashlib
 import glob
+import time
 import megazord
 
 class Target:
@@ -40,6 +41,9 @@ class Target:
         self.sources_formats = None
         self.language = 'unknown'
         self.compiled = False
+        self.hashes = {}
+        self.cache_key = None
+        self.status = None
         self.set_name(name)
         self.set_output(self.output_arg)
 
@@ -56,6 +60,16 @@ class Target:
         self.include_paths = []
         self.options = []
         self.dependencies = []
+        self.incremental = False
+        self.object_jobs = 1
+        self.unity = False
+        self.unity_size = 0
+        self.unity_exclude = []
+        self.precompiled_header = None
+        self.lto = None
+        self.training = None
+        self.pgo_phase = None
+        self.early_cutoff = None
 
     def add_include(self, names):
         """
@@ -132,32 +146,149 @@ class Target:
                 .add_library(megazord.meta.library(obj))
         return self
 
-    def assembly(self, forced=None):
+    def assembly(self, forced=None, jobs=1, keep_going=False, memory=None):
         """
-        Assemblies instance of Target class
+        Assemblies instance of Target class with all its dependencies. Every target of the dependency graph
+        is assembled only once, independent targets are assembled concurrently, the longest paths first.
         :param forced: forced rebuild even if cached version is presented. Override class variable.
+        :param jobs: number of targets assembled concurrently
+        :param keep_going: don't stop on the first failure, assemble everything that doesn't depend on failed targets
+        :param memory: budget in bytes for memory of processes of concurrently assembled targets, as measured
+        during their previous builds
         :return: returns self
         """
+        megazord.scheduler.Scheduler(jobs=jobs, keep_going=keep_going, memory=memory).run(self, forced=forced)
+        return self
+
+    async def assembly_async(self, forced=None, jobs=None, keep_going=False, timeout=None):
+        """
+        Asynchronous counterpart of assembly() running compilers through asyncio subprocesses
+        :param forced: forced rebuild even if cached version is presented. Override class variable.
+        :param jobs: number of targets assembled concurrently, unlimited by default
+        :param keep_going: don't stop on the first failure, assemble everything that doesn't depend on failed targets
+        :param timeout: timeout in seconds for every spawned process
+        :return: returns self
+        """
+        await megazord.aio.assembly(self, forced=forced, jobs=jobs, keep_going=keep_going, timeout=timeout)
+        return self
+
+    def assembly_self(self, forced=None):
+        """
+        Assemblies instance of Target class assuming that all dependencies are already assembled
+        :param forced: forced rebuild even if cached version is presented. Override class variable.
+        :return: returns self
+        """
+        start = self.assembly_started()
+        try:
+            with megazord.costs.measuring() as meter:
+                if self.prepare_assembly(forced):
+                    self.compiler.compile(self)
+                    self.finish_assembly()
+                    megazord.costs.record(self, time.perf_counter() - start, meter)
+        except BaseException:
+            self.assembly_finished(start, 'failed')
+            raise
+        self.assembly_finished(start, self.status)
+        return self
+
+    async def assembly_self_async(self, forced=None, timeout=None):
+        """
+        Asynchronous counterpart of assembly_self()
+        """
+        start = self.assembly_started()
+        try:
+            with megazord.costs.measuring() as meter:
+                # Hashing, probing and caches block, they don't run on the event loop
+                if await megazord.aio.blocking(self.prepare_assembly, forced):
+                    await self.compiler.compile_async(self, timeout)
+                    await megazord.aio.blocking(self.finish_assembly)
+                    megazord.costs.record(self, time.perf_counter() - start, meter)
+        except BaseException:
+            self.assembly_finished(start, 'failed')
+            raise
+        self.assembly_finished(start, self.status)
+        return self
+
+    def assembly_started(self):
+        megazord.events.emit('target_start', target=self.name,
+                             dependencies=[dependency.name for dependency in self.dependencies])
+        return time.perf_counter()
+
+    def assembly_finished(self, start, status):
+        megazord.events.emit('target_finish', target=self.name, start=start,
+                             duration=time.perf_counter() - start, status=status)
+
+    def prepare_assembly(self, forced=None):
+        """
+        Collects delayed sources and restores outputs from caches if it's possible
+        :param forced: forced rebuild even if cached version is presented. Override class variable.
+        :return: True if the target has to be compiled
+        """
         if forced is None:
             forced = self.forced
-        for dependency in self.dependencies:
-            if forced == 'cascade':
-                dependency.assembly(forced='cascade')
-            else:
-                dependency.assembly()
+        self.resolve()
+        start = time.perf_counter()
+        new_hash = self.hash()
+        megazord.events.emit('hash', target=self.name, start=start, duration=time.perf_counter() - start)
+        old_hash = megazord.interstate.target_storage[self.name]['hash']
+        self.cache_key = None
+        self.status = 'built'
+        up_to_date = megazord.system.exists(self.output_dir + self.output) and new_hash == old_hash
+        megazord.events.emit('cache', target=self.name, cache='interstate', hit=up_to_date)
+        if up_to_date and not (forced or forced == 'cascade'):
+            megazord.system.info("Target {} loaded from cache".format(self.name))
+            self.mark_up_to_date('cached')
+            if megazord.interstate.target_storage[self.name]['components'] is None:
+                megazord.interstate.target_storage[self.name]['components'] = self.components()
+            self.store_fingerprint()
+            return False
+        cache = megazord.cache.artifact_cache
+        if cache is not None:
+            self.cache_key = cache.key(self)
+            restored = not forced and cache.restore(self.cache_key, self)
+            megazord.events.emit('cache', target=self.name, cache='artifact', hit=restored)
+            if restored:
+                megazord.system.info("Target {} restored from artifact cache".format(self.name))
+                self.mark_up_to_date('restored')
+                self.finish_assembly(store=False)
+                return False
+            cache.detach(self)
+        megazord.interstate.target_storage[self.name]['rebuild'] = megazord.explain.changes(self, forced)
+        return True
+
+    def mark_up_to_date(self, status):
+        """
+        Marks the target assembled without compilation, so the record of its last rebuild is dropped
+        :param status: 'cached' or 'restored'
+        """
+        self.status = status
+        self.compiled = True
+        if megazord.interstate.target_storage[self.name]['rebuild'] is not None:
+            megazord.interstate.target_storage[self.name]['rebuild'] = None
+
+    def resolve(self):
+        """
+        Collects delayed sources, detects language and compiler
+        """
         if self.delayed:
             self.set_sources(self.sources_arg)
             self.__detect_language()
             self.set_compiler(self.compiler_arg)
-        new_hash = self.hash()
-        old_hash = megazord.interstate.target_storage[self.name]['hash']
-        if megazord.system.exists(self.output_dir + self.output) and new_hash == old_hash and not (forced or forced == 'cascade'):
-            megazord.system.info("Target {} loaded from cache".format(self.name))
-        else:
-            self.compiler.compile(self)
-            megazord.interstate.target_storage[self.name]['hash'] = new_hash
+
+    def finish_assembly(self, store=True):
+        """
+        Saves state of the just assembled target
+        :param store: put outputs into artifact cache
+        """
+        cache = megazord.cache.artifact_cache
+        if store and cache is not None and self.cache_key is not None:
+            cache.store(self.cache_key, self)
+        # Set of included headers may have changed during compilation
+        self.hashes = {}
+        megazord.interstate.target_storage[self.name]['hash'] = self.hash()
+        megazord.interstate.target_storage[self.name]['components'] = self.components()
+        self.store_fingerprint()
         self.compiled = True
-        return self
 
     def clear(self, cascade=False):
         """
@@ -181,23 +312,18 @@ class Target:
             self.dependencies.append(args)
         return self
 
-    def deploy_to(self, path, with_dependencies = True, exclude = None):
+    def deploy_to(self, path, with_dependencies = True, exclude = None, jobs = None, hardlink = False):
         """
-        Deploys compiled target to some folder
+        Deploys compiled target to some folder. Only files changed since the last deployment to the folder are
+        written, see megazord.deploy
         :param path:
         :param with_dependencies:
-        :param exclude:
-        :return:
-        """
-        if not self.compiled:
-            raise LookupError('Not compiled yet!')
-        if with_dependencies:
-            if not isinstance(exclude, list):
-                exclude = [exclude]
-            for dependency in self.dependencies:
-                if dependency not in exclude:
-                    dependency.deploy_to(path, exclude = exclude)
-        megazord.system.copy(self.output_dir + self.output, path)
+        :param exclude: target or list of targets not deployed
+        :param jobs: number of files written concurrently
+        :param hardlink: hardlink files instead of copying them where possible
+        :return: list of written files
+        """
+        return megazord.deploy.deploy(self, path, with_dependencies, exclude, jobs, hardlink)
 
     def __detect_language(self):
         self.language = megazord.meta.get_language_by(self.sources_formats)
@@ -206,19 +332,104 @@ class Target:
         else:
             self.language = self.language[0]
 
-    def hash(self):
-        all_hashes = []
-        for dependency in self.dependencies:
-            all_hashes.append(dependency.hash())
-        all_hashes.extend(self.includies)
-        all_hashes.extend(self.include_paths)
-        all_hashes.extend(self.libraries)
-        all_hashes.extend(self.library_paths)
-        all_hashes.append(str(self.optimization_level))
-        all_hashes.append(str(self.entry_point))
-        for source in self.sources:
-            all_hashes.append(megazord.utils.filehash(source, hashlib.md5))
-        return megazord.utils.reduce_hash(sorted(all_hashes), hashlib.md5)
+    def components(self, headers=True):
+        """
+        Components are memoized together with hashes
+        :param headers: take into account headers included by sources during the last compilation
+        :return: list of (component, fingerprint) pairs the hash of the target is built from
+        """
+        key = ('components', headers)
+        if key in self.hashes:
+            return self.hashes[key]
+        components = [('dependency:{}'.format(dependency.name), dependency.interface_hash(headers))
+                      for dependency in self.dependencies]
+        components.extend(('include:{}'.format(include), include) for include in self.includies)
+        components.extend(('include_path:{}'.format(path), path) for path in self.include_paths)
+        components.extend(('library:{}'.format(library), library) for library in self.libraries)
+        components.extend(('library_path:{}'.format(path), path) for path in self.library_paths)
+        components.extend(('option:{}'.format(option), option) for option in self.options)
+        components.append(('optimization_level', str(self.optimization_level)))
+        components.append(('entry_point', str(self.entry_point)))
+        components.append(('precompiled_header', str(self.precompiled_header)))
+        components.append(('lto', str(self.lto)))
+        components.append(('training', str(self.training)))
+        profile = megazord.interstate.target_storage[self.name]['profile']
+        if self.training is not None and profile is not None:
+            components.append(('profile', profile['digest']))
+        components.extend(zip(['source:{}'.format(source) for source in self.sources],
+                              megazord.utils.digests(self.sources)))
+        if headers:
+            header_list = self.get_headers()
+            components.extend(zip(['header:{}'.format(header) for header in header_list],
+                                  megazord.utils.headers_hashes(header_list)))
+        self.hashes[key] = components
+        return components
+
+    def hash(self, headers=True):
+        """
+        Hashes are memoized until the next assembly of the target
+        :param headers: take into account headers included by sources during the last compilation
+        :return: hash of all inputs of the target
+        """
+        if headers in self.hashes:
+            return self.hashes[headers]
+        all_hashes = [fingerprint for _, fingerprint in self.components(headers)]
+        self.hashes[headers] = megazord.utils.reduce_hash(sorted(all_hashes), hashlib.md5)
+        return self.hashes[headers]
+
+    def interface_hash(self, headers=True):
+        """
+        :param headers: take into account headers included by sources during the last compilation
+        :return: hash dependents take into account. It is the fingerprint of the output in early cutoff mode
+        if the output is up to date, hash of inputs otherwise.
+        """
+        if self.early_cutoff is None:
+            return self.hash(headers)
+        key = ('interface', headers)
+        if key in self.hashes:
+            return self.hashes[key]
+        value = self.hash(headers)
+        current = value if headers else self.hash()
+        fingerprint = megazord.interstate.target_storage[self.name]['fingerprint']
+        if self.fingerprint_valid(fingerprint, current) and fingerprint['value'] is not None and \
+                megazord.system.exists(self.output_dir + self.output):
+            value = 'output:{}'.format(fingerprint['value'])
+        self.hashes[key] = value
+        return value
+
+    def fingerprint_valid(self, fingerprint, current):
+        """
+        :param current: hash of the target
+        :return: True if the stored fingerprint was taken from the output of the target with this hash
+        """
+        return fingerprint is not None and fingerprint['hash'] == current and fingerprint['mode'] == self.early_cutoff
+
+    def store_fingerprint(self):
+        """
+        Takes the fingerprint of the output for early cutoff once, after the target is assembled or found in cache
+        """
+        storage = megazord.interstate.target_storage[self.name]
+        if self.early_cutoff is not None and not self.fingerprint_valid(storage['fingerprint'], storage['hash']):
+            storage['fingerprint'] = {'hash': storage['hash'], 'mode': self.early_cutoff, 'value': self.fingerprint()}
+
+    def fingerprint(self):
+        """
+        :return: fingerprint of the output for early cutoff or None if it can't be taken
+        """
+        output = self.output_dir + self.output
+        if not os.path.isfile(output):
+            return None
+        if self.early_cutoff == 'symbols' and self.output_format == '.so':
+            symbols = megazord.utils.symbols_hash(output)
+            if symbols is not None:
+                return symbols
+        return megazord.utils.digest(output)
+
+    def get_headers(self):
+        """
+        :return: list of headers included by sources during the last compilation
+        """
+        return megazord.interstate.target_storage[self.name]['headers'] or []
 
     def get_sources(self):
         """
@@ -255,6 +466,86 @@ class Target:
         megazord.system.info("{} used for the target {}".format(self.compiler.path, self.name))
         return self
 
+    def set_incremental(self, incremental=True, jobs=1):
+        """
+        Recompiles only changed sources. C/C++ sources are compiled to their own cached object files and linked
+        in a separate step. For Java, sources referencing classes of changed sources are recompiled too.
+        :param incremental: True if you want incremental compilation
+        :param jobs: number of object files compiled concurrently
+        :return: returns self
+        """
+        self.incremental = incremental
+        self.object_jobs = jobs
+        return self
+
+    def set_lto(self, mode='full'):
+        """
+        Enables link-time optimization of C/C++ targets. Targets linking objects of this target get it too.
+        :param mode: 'full', 'thin' (ThinLTO of Clang, parallel LTO of GCC) or None to turn it off
+        :return: returns self
+        """
+        if mode not in (None, 'full', 'thin'):
+            raise ValueError("Unknown LTO mode {}".format(mode))
+        self.lto = mode
+        return self
+
+    def set_pgo(self, training):
+        """
+        Enables profile-guided optimization of C/C++ targets. An instrumented variant of the target is built,
+        training commands are run against it and the target is rebuilt with the merged profile. The profile is
+        cached until sources, headers, flags or training commands change.
+        :param training: command or list of commands, every command is a shell-like string or a list of arguments.
+        '{binary}' is replaced by the path of the instrumented output. None turns PGO off.
+        :return: returns self
+        """
+        if isinstance(training, str):
+            training = [training]
+        self.training = training
+        return self
+
+    def set_early_cutoff(self, mode='content'):
+        """
+        Makes dependents depend on the output of the target instead of its inputs, so they aren't rebuilt when
+        a rebuild of the target gives the same output.
+        :param mode: 'content' compares the whole output, 'symbols' compares only dynamic symbols exported by
+        shared libraries (other outputs are compared as a whole), None turns early cutoff off
+        :return: returns self
+        """
+        if mode not in (None, 'content', 'symbols'):
+            raise ValueError("Unknown early cutoff mode {}".format(mode))
+        self.early_cutoff = mode
+        return self
+
+    def set_precompiled_header(self, header):
+        """
+        Sets prefix header of C/C++ sources. It is precompiled once with flags of the target, included before
+        everything else in every source and precompiled again only when it or headers it includes change.
+        :param header: path of the header or None to turn precompilation off
+        :return: returns self
+        """
+        self.precompiled_header = header
+        return self
+
+    def set_unity(self, unity=True, max_size=256 * 1024, exclude=None):
+        """
+        Compiles C/C++ sources in groups: every group is one generated source including its members, so shared
+        headers are parsed once per group. Groups are kept between runs, so editing a source recompiles
+        only its own group. Objects of groups are cached and linked like in incremental mode.
+        :param unity: True if you want unity builds
+        :param max_size: maximal total size of sources in one group in bytes
+        :param exclude: string or list of glob patterns (i.e 'src/platform_*.cpp') of sources compiled on their own
+        :return: returns self
+        """
+        self.unity = unity
+        self.unity_size = max_size
+        if exclude is None:
+            self.unity_exclude = []
+        elif isinstance(exclude, list):
+            self.unity_exclude = exclude
+        else:
+            self.unity_exclude = [exclude]
+        return self
+
     def set_name(self, name):
         """
         Changes reproducable name of target
@@ -292,7 +583,9 @@ class Target:
             self.output_dir = self.output
             self.output = self.name  + megazord.meta.get_default_output_format_for_language(self.language)
         else:
-            self.output_dir = os.path.dirname(os.path.relpath(self.output))
+            # relpath() is costly and gives the same as normpath() for relative paths
+            output = os.path.relpath(self.output) if os.path.isabs(self.output) else os.path.normpath(self.output)
+            self.output_dir = os.path.dirname(output)
             self.output = os.path.basename(self.output)
 
         if len(self.output_dir) == 0:
@@ -0,0 +1,120 @@
+"""
+Toolchain caches results of probing tools (resolved paths, versions, *-config output) in interstate.
+Entries are invalidated by changes of PATH, its directories and mtimes of the probed binaries.
+"""
+
+import os
+import threading
+import subprocess
+import megazord
+
+lock = threading.RLock()
+probes = None
+path_fingerprint = None
+
+
+def load():
+    global probes
+    with lock:
+        if probes is None:
+            probes = megazord.interstate.load_object('toolchain') or {}
+        return probes
+
+
+def save():
+    with lock:
+        megazord.interstate.save_object('toolchain', probes)
+
+
+def refresh():
+    """
+    Drops all cached probes, they will be probed again on first use
+    """
+    global probes, path_fingerprint
+    with lock:
+        probes = {}
+        path_fingerprint = None
+        save()
+
+
+def environment():
+    """
+    :return: fingerprint of PATH and mtimes of its directories
+    """
+    global path_fingerprint
+    with lock:
+        if path_fingerprint is None:
+            fingerprint = [os.environ.get('PATH', '')]
+            for directory in os.environ.get('PATH', '').split(os.pathsep):
+                try:
+                    fingerprint.append(str(os.stat(directory).st_mtime_ns))
+                except OSError:
+                    fingerprint.append('')
+            path_fingerprint = ':'.join(fingerprint)
+        return path_fingerprint
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+def valid(entry, binary):
+    return entry is not None and entry[0] == environment() and entry[1] == mtime(binary)
+
+
+def store(key, binary, result):
+    with lock:
+        load()[key] = (environment(), mtime(binary), result)
+        save()
+    return result
+
+
+def probe(key, binary, func):
+    """
+    Returns cached result of func() if environment and mtime of the binary haven't changed
+    """
+    with lock:
+        entry = load().get(key)
+    if valid(entry, binary):
+        return entry[2]
+    return store(key, binary, func())
+
+
+def which(name):
+    """
+    :return: cached full path of the tool or None if it isn't found
+    """
+    with lock:
+        entry = load().get(('which', name))
+    if entry is not None and valid(entry, entry[2]):
+        return entry[2]
+    result = megazord.system.which(name)
+    return store(('which', name), result, result)
+
+
+def version(path):
+    """
+    :return: cached first line of `path --version`
+    """
+    binary = which(path)
+
+    def get_version():
+        try:
+            output = subprocess.check_output([path, '--version'], stderr=subprocess.STDOUT)
+            return output.decode('utf-8', 'replace').split('\n')[0]
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return probe(('version', binary), binary, get_version)
+
+
+def config(name, arg):
+    """
+    :return: cached output of `name-config --arg`
+    """
+    tool = "{}-config".format(name)
+    return probe(('config', tool, arg), which(tool),
+                 lambda: megazord.system.call(tool, "--{}".format(arg))[:-1].decode("utf-8"))
@@ -1,6 +1,14 @@
 import os
 import re
+import shlex
+import struct
+import asyncio
+import fnmatch
+import json
+import hashlib
 import subprocess
+import contextvars
+import concurrent.futures
 
 import megazord
 
@@ -8,11 +16,25 @@ import megazord
 # It consists of several functions and ArgBuilder class
 class GenericTool:
     def __init__(self, path):
-        if megazord.system.which(path) is not None:
+        if megazord.toolchain.which(path) is not None:
             self.path = path
         else:
             raise FileNotFoundError("{} was not found".format(path))
 
+    def identity(self):
+        """
+        :return: string identifying the exact binary of the tool
+        """
+        real_path = os.path.realpath(megazord.toolchain.which(self.path))
+        stat = os.stat(real_path)
+        return '{}:{}:{}'.format(real_path, stat.st_size, stat.st_mtime_ns)
+
+    def version(self):
+        """
+        :return: version string reported by the tool
+        """
+        return megazord.toolchain.version(self.path)
+
 class GenericCompiler(GenericTool):
     # The main aim of ArgBuilder is hiding details of flags appending to the calling of
     # the tool
@@ -47,8 +69,30 @@ class GenericCompiler(GenericTool):
         args = self.prepare_args(target)
         megazord.system.call(self.path, *args.build())
 
+    async def compile_async(self, target, timeout=None):
+        """
+        Asynchronous counterpart of compile()
+        :param timeout: timeout in seconds for every spawned process
+        """
+        args = self.prepare_args(target)
+        await megazord.aio.call(self.path, *args.build(), timeout=timeout)
+
+    def link_paths(self, target):
+        """
+        :return: absolute paths the output of the target refers to, they are a part of its artifact cache key
+        """
+        return []
+
+    def restored(self, target):
+        """
+        Called after outputs of the target were restored from the artifact cache instead of compilation
+        """
+        pass
+
 
 class CCompiler(GenericCompiler):
+    pch_extension = '.gch'
+
     class CArgBuilder(GenericCompiler.ArgBuilder):
         def add_include_path(self, path):
             self.append('-I{}'.format(path))
@@ -74,6 +118,10 @@ class CCompiler(GenericCompiler):
             self.append('-o{}'.format(name))
             return self
 
+        def add_depfile(self, path):
+            self.append('-MMD', '-MF', path)
+            return self
+
         def set_std(self, std='c++11'):
             self.append('-std={}'.format(std))
             return self
@@ -89,27 +137,55 @@ class CCompiler(GenericCompiler):
         def build(self):
             return self.flags
 
-    def prepare_args(self, target):
-        args = self.CArgBuilder()
+    def add_common_args(self, args, target, with_profile=True):
+        """
+        :param with_profile: add flags using the current profile of a PGO target
+        """
         args.set_std()
         for option in megazord.utils.unique_everseen(target.options):
             args.add_option(option)
         args.append('-O{}'.format(target.optimization_level))
-        if target.output_format in ['.so', '.dylib']:
-            if not target.output.startswith('lib'):
-                megazord.system.warning("{} name doesn't start with 'lib'".format(target))
-                megazord.system.create_symlink(target.output, target.output_dir + 'lib' + target.output)
-            if megazord.system.uname == 'darwin':
-                args.append('-install_name')
-                args.append('@rpath/{}'.format(target.output))
-        args.set_output_name((target.output_dir if target.output_dir != './' else '') + target.output)
-        args.set_target(target.get_sources(), target.output_format)
-        compiled_lib_paths = []
+        if target.lto is not None:
+            args.append(*self.lto_args(target.lto))
+        if target.pgo_phase == 'generate':
+            args.append(*self.pgo_generate_args(self.pgo_dir(target) + 'raw'))
+        elif target.training is not None and with_profile:
+            profile = megazord.interstate.target_storage[target.name]['profile']
+            if profile is not None:
+                args.append(*self.pgo_use_args(profile['path']))
+        return args
+
+    def lto_args(self, mode):
+        # GCC has no ThinLTO, parallel whole-program optimization is the closest
+        return ['-flto'] if mode == 'full' else ['-flto=auto']
+
+    def pgo_generate_args(self, directory):
+        return ['-fprofile-generate={}'.format(directory)]
+
+    def pgo_use_args(self, profile):
+        return ['-fprofile-use={}'.format(profile), '-fprofile-correction', '-Wno-missing-profile']
+
+    def merge_profiles(self, raw, directory):
+        """
+        Collects profiles written by training runs into directory
+        :return: path of the profile for pgo_use_args()
+        """
+        # Profiles of objects outside of the current directory are written to subdirectories of raw
+        for root, _, names in os.walk(raw):
+            for name in names:
+                if name.endswith('.gcda'):
+                    path = os.path.join(directory, os.path.relpath(os.path.join(root, name), raw))
+                    megazord.system.mkdir_p(os.path.dirname(path))
+                    megazord.system.copy(os.path.join(root, name), path)
+        return directory
+
+    def add_dependencies_args(self, args, target):
+        lto = None
         for dependency in target.dependencies:
             if dependency.output_format == '.o':
                 args.append(dependency.output)
+                lto = lto or dependency.lto
             elif dependency.output_format in ['.so', '.dylib']:
-                compiled_lib_paths.append(dependency.output_dir)
                 if dependency.output_name.startswith('lib'):
                     args.add_library(dependency.output_name[3:])
                 else:
@@ -118,17 +194,581 @@ class CCompiler(GenericCompiler):
                 raise ValueError("{} cannot be processed as dependency for {}. "
                                  "Did you forget to set output format for dependency to '.o'?".format(
                     dependency.sources))
-        for lib_path in megazord.utils.unique_everseen(compiled_lib_paths + target.library_paths):
-            args.add_library_path(megazord.system.abs_path(lib_path))
-            args.append('-Wl,-rpath,{}'.format(megazord.system.abs_path(lib_path)))
+        for lib_path in self.link_paths(target):
+            args.add_library_path(lib_path)
+            args.append('-Wl,-rpath,{}'.format(lib_path))
+        if target.lto is None and lto is not None:
+            # Objects with LTO bytecode can be linked only with LTO
+            args.append(*self.lto_args(lto))
+        return args
+
+    def link_paths(self, target):
+        """
+        :return: absolute library paths of the target, they are baked into its output as rpath
+        """
+        compiled_lib_paths = [dependency.output_dir for dependency in target.dependencies
+                              if dependency.output_format in ['.so', '.dylib']]
+        return [megazord.system.abs_path(lib_path)
+                for lib_path in megazord.utils.unique_everseen(compiled_lib_paths + target.library_paths)]
+
+    def add_include_args(self, args, target):
         for include_path in megazord.utils.unique_everseen(target.include_paths):
             args.add_include_path(include_path)
-        for library in target.libraries:
-            args.add_library(library)
+        return args
+
+    def add_includies_args(self, args, target):
         for include in megazord.utils.unique_everseen(target.includies):
             args.add_include(include)
         return args
 
+    def add_pch_args(self, args, target):
+        if target.precompiled_header is not None:
+            stub, _ = self.pch_paths(target)
+            args.append('-include', stub)
+        return args
+
+    def add_output_args(self, args, target):
+        if target.output_format in ['.so', '.dylib']:
+            if not target.output.startswith('lib'):
+                megazord.system.warning("{} name doesn't start with 'lib'".format(target))
+                megazord.system.create_symlink(target.output, target.output_dir + 'lib' + target.output)
+            if megazord.system.uname == 'darwin':
+                args.append('-install_name')
+                args.append('@rpath/{}'.format(target.output))
+        args.set_output_name((target.output_dir if target.output_dir != './' else '') + target.output)
+        return args
+
+    def prepare_args(self, target):
+        args = self.CArgBuilder()
+        self.add_common_args(args, target)
+        self.add_output_args(args, target)
+        args.set_target(target.get_sources(), target.output_format)
+        self.add_dependencies_args(args, target)
+        self.add_include_args(args, target)
+        for library in target.libraries:
+            args.add_library(library)
+        self.add_pch_args(args, target)
+        self.add_includies_args(args, target)
+        if len(target.get_sources()) == 1:
+            args.add_depfile(self.depfile_name(target))
+        return args
+
+    def prepare_object_args(self, target, source, obj):
+        """
+        Arguments for compiling one source of the target into its own object file
+        """
+        args = self.CArgBuilder()
+        self.add_common_args(args, target)
+        self.add_include_args(args, target)
+        self.add_pch_args(args, target)
+        self.add_includies_args(args, target)
+        args.set_output_name(obj)
+        args.add_depfile(obj + '.d')
+        args.set_target([source], '.o')
+        return args
+
+    def prepare_preprocess_args(self, target, source, obj, output):
+        """
+        Arguments for preprocessing the source of obj, its depfile is written as by compilation
+        """
+        args = self.CArgBuilder()
+        args.set_std()
+        self.add_include_args(args, target)
+        self.add_pch_args(args, target)
+        self.add_includies_args(args, target)
+        args.set_output_name(output)
+        args.add_depfile(obj + '.d')
+        args.append('-E', source)
+        return args
+
+    def prepare_remote_args(self, target):
+        """
+        Arguments for compiling preprocessed sources of the target on workers, see megazord.remote
+        """
+        return self.add_common_args(self.CArgBuilder(), target)
+
+    def prepare_link_args(self, target, objects):
+        """
+        Arguments for linking object files of the target into its output
+        """
+        args = self.CArgBuilder()
+        self.add_common_args(args, target)
+        self.add_output_args(args, target)
+        args.set_target(objects, target.output_format)
+        self.add_dependencies_args(args, target)
+        for library in target.libraries:
+            args.add_library(library)
+        return args
+
+    def pch_paths(self, target):
+        """
+        Precompiled headers are shared by all targets with the same prefix header, flags and compiler
+        :return: path of the stub including the prefix header and path of the precompiled header built from it
+        """
+        args = self.add_include_args(self.add_common_args(self.CArgBuilder(), target), target).build()
+        key = megazord.utils.reduce_hash([' '.join([megazord.system.abs_path(target.precompiled_header),
+                                                    self.identity()] + args)], hashlib.md5)
+        stub = megazord.interstate.mzdir('pch/{}/{}'.format(key, os.path.basename(target.precompiled_header)))
+        return stub, stub + self.pch_extension
+
+    def prepare_pch_args(self, target, stub, output):
+        """
+        Arguments for precompiling the prefix header of the target
+        """
+        args = self.CArgBuilder()
+        self.add_common_args(args, target)
+        self.add_include_args(args, target)
+        args.set_output_name(output)
+        args.add_depfile(output + '.d')
+        args.append('-x', 'c-header' if target.language == 'c' else 'c++-header', stub)
+        return args
+
+    def plan_pch(self, target):
+        """
+        :return: path of the precompiled header, temporary file and arguments for building it there,
+        or None if it is up to date
+        """
+        if target.precompiled_header is None:
+            return None
+        stub, output = self.pch_paths(target)
+        megazord.system.mkdir_p(os.path.dirname(stub))
+        megazord.utils.write_if_changed(stub, '#include "{}"\n'.format(
+            megazord.system.abs_path(target.precompiled_header)))
+        if os.path.isfile(output) and os.path.isfile(output + '.json'):
+            with open(output + '.json') as f:
+                state = json.load(f)
+            if state['hash'] == megazord.utils.reduce_hash(megazord.utils.headers_hashes(state['headers']),
+                                                          hashlib.md5):
+                return None
+        tmp_file = megazord.system.mkstemp(os.path.dirname(stub))
+        return output, tmp_file, self.prepare_pch_args(target, stub, tmp_file).build()
+
+    def pch_compiled(self, output, tmp_file):
+        """
+        Moves just built precompiled header in place and saves headers it was built from
+        """
+        headers = [h for h in megazord.utils.parse_depfile(tmp_file + '.d')
+                   if os.path.dirname(h) != os.path.dirname(output)]
+        os.remove(tmp_file + '.d')
+        os.replace(tmp_file, output)
+        with open(output + '.json', 'w') as f:
+            json.dump({'hash': megazord.utils.reduce_hash(megazord.utils.headers_hashes(headers), hashlib.md5),
+                       'headers': headers}, f)
+
+    def pch_headers(self, target):
+        """
+        Compilers don't list headers loaded from precompiled headers in depfiles
+        :return: headers the precompiled header of the target was built from
+        """
+        if target.precompiled_header is None:
+            return []
+        _, output = self.pch_paths(target)
+        if not os.path.isfile(output + '.json'):
+            return []
+        with open(output + '.json') as f:
+            return json.load(f)['headers']
+
+    def precompile_header(self, target):
+        """
+        Builds the precompiled prefix header of the target unless it is up to date
+        """
+        plan = self.plan_pch(target)
+        if plan is not None:
+            output, tmp_file, args = plan
+            try:
+                megazord.system.call(self.path, *args)
+            except BaseException:
+                megazord.utils.remove_files(tmp_file, tmp_file + '.d')
+                raise
+            self.pch_compiled(output, tmp_file)
+
+    async def precompile_header_async(self, target, timeout=None):
+        """
+        Asynchronous counterpart of precompile_header()
+        """
+        plan = self.plan_pch(target)
+        if plan is not None:
+            output, tmp_file, args = plan
+            try:
+                await megazord.aio.call(self.path, *args, timeout=timeout)
+            except BaseException:
+                megazord.utils.remove_files(tmp_file, tmp_file + '.d')
+                raise
+            self.pch_compiled(output, tmp_file)
+
+    def object_dir(self, target):
+        return megazord.interstate.mzdir('objects/{}/'.format(target.name))
+
+    def object_name(self, target, source):
+        name = os.path.splitext(os.path.basename(source))[0]
+        return self.object_dir(target) + '{}-{}.o'.format(name, hashlib.md5(source.encode('utf-8')).hexdigest()[:8])
+
+    def object_hash(self, source, args, headers):
+        hashes = [megazord.utils.digest(source), ' '.join(args)]
+        hashes.extend(megazord.utils.headers_hashes(headers))
+        return megazord.utils.reduce_hash(hashes, hashlib.md5)
+
+    def depfile_name(self, target):
+        return megazord.interstate.mzdir('deps/{}.d'.format(target.name))
+
+    def units_dir(self, target):
+        return megazord.interstate.mzdir('units/{}/'.format(target.name))
+
+    def unity_dir(self, target):
+        return megazord.interstate.mzdir('unity/{}/'.format(target.name))
+
+    def unity_language(self, source):
+        return '.c' if os.path.splitext(source)[1] == '.c' else '.cpp'
+
+    def unity_groups(self, target, sources):
+        """
+        Groups sources keeping groups of the previous run: sources stay in their groups, groups grown above
+        the size limit are split and new sources are added to the newest group of the same language while it fits.
+        :return: dict {id of the group: list of sources}
+        """
+        old_groups = megazord.interstate.target_storage[target.name]['unity'] or {}
+        sizes = {source: os.path.getsize(source) for source in sources}
+        remaining = set(sources)
+        groups = {}
+        next_id = max(old_groups.keys(), default=-1) + 1
+        for group_id in sorted(old_groups):
+            members = [source for source in old_groups[group_id] if source in remaining]
+            size = 0
+            for source in members:
+                if size > 0 and size + sizes[source] > target.unity_size:
+                    group_id, next_id, size = next_id, next_id + 1, 0
+                groups.setdefault(group_id, []).append(source)
+                remaining.discard(source)
+                size += sizes[source]
+        for source in sorted(remaining):
+            language = self.unity_language(source)
+            candidates = [i for i in groups if self.unity_language(groups[i][0]) == language]
+            group_id = max(candidates, default=None)
+            if group_id is None or sum(sizes[s] for s in groups[group_id]) + sizes[source] > target.unity_size:
+                group_id, next_id = next_id, next_id + 1
+            groups.setdefault(group_id, []).append(source)
+        megazord.interstate.target_storage[target.name]['unity'] = groups
+        return groups
+
+    def translation_units(self, target):
+        """
+        :return: sources compiled to their own object files. For unity builds these are generated group sources
+        and sources excluded from groups.
+        """
+        sources = target.get_sources()
+        if not target.unity:
+            return sources
+        excluded = [s for s in sources if any(fnmatch.fnmatch(s, pattern) for pattern in target.unity_exclude)]
+        groups = self.unity_groups(target, [s for s in sources if s not in excluded])
+        megazord.system.mkdir_p(self.unity_dir(target))
+        units = []
+        for group_id, members in sorted(groups.items()):
+            unit = self.unity_dir(target) + 'unity-{}{}'.format(group_id, self.unity_language(members[0]))
+            content = ''.join('#include "{}"\n'.format(megazord.system.abs_path(s)) for s in members)
+            megazord.utils.write_if_changed(unit, content)
+            units.append(unit)
+        for name in os.listdir(self.unity_dir(target)):
+            if self.unity_dir(target) + name not in units:
+                os.remove(self.unity_dir(target) + name)
+        return units + excluded
+
+    def plan_objects(self, target):
+        """
+        Finds objects whose source, included headers or compilation flags have changed since the last run
+        and removes objects of deleted sources.
+        :return: dict of all objects of the target with their hashes and headers and list of outdated objects
+        """
+        megazord.system.mkdir_p(self.object_dir(target))
+        old_objects = megazord.interstate.target_storage[target.name]['objects'] or {}
+        new_objects = {}
+        outdated = []
+        for source in self.translation_units(target):
+            obj = self.object_name(target, source)
+            args = self.prepare_object_args(target, source, obj).build()
+            old = old_objects.get(obj)
+            headers = old[1] if isinstance(old, tuple) else []
+            new_objects[obj] = (self.object_hash(source, args, headers), headers)
+            if old != new_objects[obj] or not megazord.system.exists(obj):
+                outdated.append((obj, source, args))
+        for obj in old_objects:
+            if obj not in new_objects and megazord.system.exists(obj):
+                megazord.system.rm(obj)
+        return new_objects, outdated
+
+    def object_compiled(self, target, obj, source, args):
+        """
+        :return: hash and headers of just compiled object
+        """
+        headers = [h for h in megazord.utils.parse_depfile(obj + '.d') if h != source]
+        headers.extend(h for h in self.pch_headers(target) if h not in headers)
+        return self.object_hash(source, args, headers), headers
+
+    def compile_object(self, target, obj, source, args):
+        """
+        Compiles the object on a worker if distributed compilation is enabled, see megazord.remote,
+        and locally otherwise or if it fails
+        """
+        if megazord.remote.enabled():
+            try:
+                return megazord.remote.compile(self, target, obj, source, args)
+            except megazord.remote.Unavailable as e:
+                megazord.system.warning("{}, compiling {} locally".format(e, source))
+        megazord.system.call(self.path, *args)
+
+    def objects_compiled(self, target, new_objects, outdated, compiled):
+        """
+        Saves state of compiled objects
+        :return: list of object files and list of headers included by them
+        """
+        megazord.interstate.target_storage[target.name]['objects'] = compiled
+        if len(outdated) == 0:
+            megazord.system.info("All objects of {} loaded from cache".format(target.name))
+        headers = set()
+        for _, object_headers in compiled.values():
+            headers.update(object_headers)
+        return list(new_objects.keys()), sorted(headers)
+
+    def compile_objects(self, target):
+        """
+        Compiles every source of the target to its own cached object file. Only outdated objects are recompiled.
+        :return: list of object files and list of headers included by them
+        """
+        new_objects, outdated = self.plan_objects(target)
+
+        def compile_object(obj, source, args):
+            self.compile_object(target, obj, source, args)
+            return self.object_compiled(target, obj, source, args)
+
+        outdated_objects = set(obj for obj, _, _ in outdated)
+        compiled = {obj: new_objects[obj] for obj in new_objects if obj not in outdated_objects}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(target.object_jobs, 1)) as executor:
+                # Processes of objects are measured as processes of the target, see megazord.costs
+                futures = {executor.submit(contextvars.copy_context().run, compile_object, *job): job[0]
+                           for job in outdated}
+                for future in concurrent.futures.as_completed(futures):
+                    compiled[futures[future]] = future.result()
+        finally:
+            result = self.objects_compiled(target, new_objects, outdated, compiled)
+        return result
+
+    async def compile_objects_async(self, target, timeout=None):
+        """
+        Asynchronous counterpart of compile_objects()
+        """
+        new_objects, outdated = await megazord.aio.blocking(self.plan_objects, target)
+        semaphore = megazord.aio.asyncio.Semaphore(max(target.object_jobs, 1))
+
+        async def compile_object(obj, source, args):
+            async with semaphore:
+                if megazord.remote.enabled():
+                    await megazord.aio.blocking(self.compile_object, target, obj, source, args)
+                else:
+                    await megazord.aio.call(self.path, *args, timeout=timeout)
+            compiled[obj] = self.object_compiled(target, obj, source, args)
+
+        outdated_objects = set(obj for obj, _, _ in outdated)
+        compiled = {obj: new_objects[obj] for obj in new_objects if obj not in outdated_objects}
+        try:
+            await megazord.aio.gather(*[compile_object(*job) for job in outdated])
+        finally:
+            result = self.objects_compiled(target, new_objects, outdated, compiled)
+        return result
+
+    def restored(self, target):
+        if target.output_format in ['.so', '.dylib'] and not target.output.startswith('lib'):
+            megazord.system.create_symlink(target.output, target.output_dir + 'lib' + target.output)
+
+    def collect_headers(self, target, depfiles=None):
+        """
+        Saves headers included by the target sources
+        :param depfiles: depfiles of units of multi-source targets, see units()
+        """
+        sources = target.get_sources()
+        headers = []
+        for depfile in depfiles or [self.depfile_name(target)]:
+            headers.extend(megazord.utils.parse_depfile(depfile))
+        return sorted(set(h for h in headers + self.pch_headers(target) if h not in sources))
+
+    def units(self, target):
+        """
+        Sources of multi-source targets are compiled one by one to temporary objects, as the compiler driver does,
+        but every one writes its own depfile, so headers are known without preprocessing sources again
+        :return: list of (object, source, args) of sources of the target
+        """
+        directory = self.units_dir(target)
+        if os.path.exists(directory):
+            megazord.system.rm(directory)
+        megazord.system.mkdir_p(directory)
+        units = []
+        for i, source in enumerate(target.get_sources()):
+            # Objects keep their paths between builds, GCC names profiles of PGO after them
+            obj = '{}{}-{}.o'.format(directory, i, os.path.splitext(os.path.basename(source))[0])
+            units.append((obj, source, self.prepare_object_args(target, source, obj).build()))
+        return units
+
+    def units_linked(self, target, units):
+        """
+        Removes temporary objects of the just linked target
+        :return: list of headers included by its sources
+        """
+        headers = self.collect_headers(target, [obj + '.d' for obj, _, _ in units])
+        megazord.system.rm(self.units_dir(target))
+        return headers
+
+    def compile_units(self, target):
+        """
+        Compiles sources of the multi-source target one by one and links them
+        :return: list of headers included by the sources
+        """
+        units = self.units(target)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(target.object_jobs, 1)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, megazord.system.call, self.path, *args)
+                       for _, _, args in units]
+            for future in futures:
+                future.result()
+        megazord.system.call(self.path, *self.prepare_link_args(target, [obj for obj, _, _ in units]).build())
+        return self.units_linked(target, units)
+
+    async def compile_units_async(self, target, timeout=None):
+        """
+        Asynchronous counterpart of compile_units()
+        """
+        units = await megazord.aio.blocking(self.units, target)
+        semaphore = asyncio.Semaphore(max(target.object_jobs, 1))
+
+        async def compile_unit(args):
+            async with semaphore:
+                await megazord.aio.call(self.path, *args, timeout=timeout)
+
+        await megazord.aio.gather(*[compile_unit(args) for _, _, args in units])
+        await megazord.aio.call(self.path, *self.prepare_link_args(target, [obj for obj, _, _ in units]).build(),
+                                timeout=timeout)
+        return self.units_linked(target, units)
+
+    def pgo_dir(self, target):
+        return megazord.interstate.mzdir('pgo/{}/'.format(target.name))
+
+    def pgo_key(self, target):
+        """
+        :return: key of the profile of the target, it changes with sources, headers, flags and training commands.
+        Flags of the current profile don't belong to it.
+        """
+        hashes = megazord.utils.digests(target.get_sources())
+        hashes.extend(megazord.utils.headers_hashes(target.get_headers()))
+        hashes.extend(dependency.interface_hash() for dependency in target.dependencies)
+        hashes.append(' '.join([self.identity(), str(target.training), str(target.lto)] +
+                               self.add_include_args(self.add_common_args(self.CArgBuilder(), target,
+                                                                          with_profile=False), target).build()))
+        return megazord.utils.reduce_hash(hashes, hashlib.md5)
+
+    def plan_training(self, target):
+        """
+        :return: key of the profile and training commands, or None if the profile is cached
+        """
+        profile = megazord.interstate.target_storage[target.name]['profile']
+        key = self.pgo_key(target)
+        if profile is not None and profile['key'] == key and os.path.exists(profile['path']):
+            return None
+        raw = self.pgo_dir(target) + 'raw'
+        if os.path.exists(raw):
+            megazord.system.rm(raw)
+        megazord.system.mkdir_p(raw)
+        binary = megazord.system.abs_path((target.output_dir if target.output_dir != './' else '') + target.output)
+        commands = []
+        for command in target.training:
+            command = shlex.split(command) if isinstance(command, str) else list(command)
+            commands.append([arg.replace('{binary}', binary) for arg in command])
+        return key, commands
+
+    def training_finished(self, target, key):
+        """
+        Merges profiles of training runs and makes them the profile of the target
+        """
+        directory = self.pgo_dir(target) + key
+        if os.path.exists(directory):
+            megazord.system.rm(directory)
+        megazord.system.mkdir_p(directory)
+        path = self.merge_profiles(self.pgo_dir(target) + 'raw', directory)
+        files = sorted(os.path.join(d, f) for d, _, fs in os.walk(directory) for f in fs)
+        if not files:
+            raise FileNotFoundError("Training of {} produced no profiles".format(target.name))
+        digest = megazord.utils.reduce_hash(megazord.utils.digests(files), hashlib.md5)
+        megazord.interstate.target_storage[target.name]['profile'] = {'key': key, 'path': path, 'digest': digest}
+        for name in os.listdir(self.pgo_dir(target)):
+            if name not in (key, 'raw'):
+                megazord.system.rm(self.pgo_dir(target) + name)
+
+    def train(self, target):
+        """
+        Builds instrumented variant of the target and trains it unless the profile is cached
+        """
+        plan = self.plan_training(target)
+        if plan is None:
+            return
+        key, commands = plan
+        target.pgo_phase = 'generate'
+        try:
+            self.build(target)
+        finally:
+            target.pgo_phase = None
+        for command in commands:
+            megazord.system.call(*command)
+        self.training_finished(target, key)
+
+    async def train_async(self, target, timeout=None):
+        """
+        Asynchronous counterpart of train()
+        """
+        plan = await megazord.aio.blocking(self.plan_training, target)
+        if plan is None:
+            return
+        key, commands = plan
+        target.pgo_phase = 'generate'
+        try:
+            await self.build_async(target, timeout)
+        finally:
+            target.pgo_phase = None
+        for command in commands:
+            await megazord.aio.call(*command, timeout=timeout)
+        self.training_finished(target, key)
+
+    def compile(self, target):
+        if target.training is not None:
+            self.train(target)
+        self.build(target)
+
+    async def compile_async(self, target, timeout=None):
+        if target.training is not None:
+            await self.train_async(target, timeout)
+        await self.build_async(target, timeout)
+
+    def build(self, target):
+        megazord.system.mkdir_p(megazord.interstate.mzdir('deps'))
+        self.precompile_header(target)
+        if (target.incremental or target.unity) and target.output_format != '.o':
+            objects, headers = self.compile_objects(target)
+            megazord.system.call(self.path, *self.prepare_link_args(target, objects).build())
+        elif len(target.get_sources()) != 1 and target.output_format != '.o':
+            headers = self.compile_units(target)
+        else:
+            super(CCompiler, self).compile(target)
+            headers = self.collect_headers(target)
+        megazord.interstate.target_storage[target.name]['headers'] = headers
+
+    async def build_async(self, target, timeout=None):
+        megazord.system.mkdir_p(megazord.interstate.mzdir('deps'))
+        await self.precompile_header_async(target, timeout)
+        if (target.incremental or target.unity) and target.output_format != '.o':
+            objects, headers = await self.compile_objects_async(target, timeout)
+            await megazord.aio.call(self.path, *self.prepare_link_args(target, objects).build(), timeout=timeout)
+        elif len(target.get_sources()) != 1 and target.output_format != '.o':
+            headers = await self.compile_units_async(target, timeout)
+        else:
+            await super(CCompiler, self).compile_async(target, timeout)
+            headers = self.collect_headers(target)
+        megazord.interstate.target_storage[target.name]['headers'] = headers
+
 class DmdCompiler(GenericCompiler):
     def __init__(self, path='dmd'):
         super(DmdCompiler, self).__init__(path)
@@ -145,67 +785,99 @@ class GppCompiler(CCompiler):
 
 
 class ClangCompiler(CCompiler):
+    pch_extension = '.pch'
+
     def __init__(self, path='clang'):
         super(ClangCompiler, self).__init__(path)
 
+    def lto_args(self, mode):
+        return ['-flto={}'.format(mode)]
 
-class ClangppCompiler(CCompiler):
-    def __init__(self, path='clang++'):
-        super(ClangppCompiler, self).__init__(path)
+    def pgo_use_args(self, profile):
+        return ['-fprofile-use={}'.format(profile)]
 
+    def merge_profiles(self, raw, directory):
+        profiles = [os.path.join(raw, name) for name in sorted(os.listdir(raw)) if name.endswith('.profraw')]
+        if not profiles:
+            raise FileNotFoundError("Training produced no profiles in {}".format(raw))
+        output = os.path.join(directory, 'default.profdata')
+        megazord.system.call(self.profdata(), 'merge', '-output={}'.format(output), *profiles)
+        return output
 
-class JarTool(GenericTool):
-    class JarArgBuilder(GenericCompiler.ArgBuilder):
-        def set_output_name(self, name):
-            self.append('{}'.format(name))
-            return self
+    def profdata(self):
+        """
+        :return: llvm-profdata of the same LLVM as the compiler
+        """
+        sibling = os.path.join(os.path.dirname(os.path.realpath(megazord.toolchain.which(self.path))), 'llvm-profdata')
+        if os.path.isfile(sibling):
+            return sibling
+        if megazord.toolchain.which('llvm-profdata') is not None:
+            return 'llvm-profdata'
+        raise FileNotFoundError("llvm-profdata was not found")
 
-        def set_target(self, sources):
-            self.append(*sources)
-            return self
+    def add_pch_args(self, args, target):
+        if target.precompiled_header is not None:
+            _, output = self.pch_paths(target)
+            args.append('-include-pch', output)
+        return args
 
-    def __init__(self, path='jar'):
-        super(JarTool, self).__init__(path)
 
-    def prepare_args(self, output_name, sources, entry_point=None):
-        args = self.JarArgBuilder()
-        if entry_point is None:
-            args.append('cvf')
-        else:
-            args.append('cfe')
-        args.set_output_name(output_name)
-        if entry_point is not None:
-            args.append(entry_point)
-        args.set_target(sources)
-        return args
+class ClangppCompiler(ClangCompiler):
+    def __init__(self, path='clang++'):
+        super(ClangppCompiler, self).__init__(path)
+
+
+class JarTool:
+    """
+    Packs classes of Java targets into JAR files in-process, see megazord.jar
+    """
+    def __init__(self, path=None):
+        """
+        :param path: ignored, the jar tool isn't required anymore
+        """
+        self.path = path
 
     def collect_classes(self, target):
-        all_class_files = [f for f in os.listdir(target.output_dir) if
-                           os.path.isfile(os.path.join(target.output_dir, f))]
-        related_class_files = []
+        """
+        :return: dict {name of the entry: path of the class file} of classes produced by sources of the target
+        """
+        state = megazord.interstate.target_storage[target.name]['classes'] or {}
+        if target.incremental and all(source in state for source in target.get_sources()):
+            return {name + '.class': os.path.join(target.output_dir, name + '.class')
+                    for source in target.get_sources() for name in state[source]['classes']}
         sources_names = set()
         for sources_name in target.sources_names:
             sources_names.add(os.path.basename(sources_name))
-        for cf in all_class_files:
-            if not cf.endswith('.class'):
-                continue
-            cf_crop = re.match("(\w+)[\$\.$]", cf).group(1)
-            if cf_crop in sources_names:
-                related_class_files.append(cf)
+        related_class_files = {}
+        for directory, _, files in os.walk(target.output_dir):
+            for cf in files:
+                if not cf.endswith('.class'):
+                    continue
+                cf_crop = re.match(r"([^$.]+)", cf).group(1)
+                if cf_crop in sources_names:
+                    path = os.path.join(directory, cf)
+                    related_class_files[os.path.relpath(path, target.output_dir).replace(os.sep, '/')] = path
         return related_class_files
 
     def run(self, target, name):
-        tmp_file = megazord.system.mkstemp(target.output_dir)
-        print(tmp_file)
+        """
+        Writes JAR with classes of the target, see megazord.jar.write
+        :return: True if the JAR was written, False if it was up to date
+        """
         if not target.compiled:
             target.assembly()
-        classes = self.collect_classes(target)
-        args = self.prepare_args(tmp_file, classes, target.entry_point)
-        old_wd = megazord.system.getwd()
-        megazord.system.setwd(target.output_dir)
-        megazord.system.call(self.path, *args.build())
-        megazord.system.setwd(old_wd)
-        megazord.system.move(tmp_file, name)
+        return megazord.jar.write(name, self.collect_classes(target), target.entry_point)
+
+    async def run_async(self, target, name, timeout=None):
+        """
+        Asynchronous counterpart of run(). The JAR is written in the default executor of the loop.
+        """
+        if not target.compiled:
+            await target.assembly_async(timeout=timeout)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, megazord.jar.write, name, self.collect_classes(target),
+                                          target.entry_point)
+
 
 class JavaCompiler(GenericCompiler):
     class JavaArgBuilder(GenericCompiler.ArgBuilder):
@@ -227,15 +899,176 @@ class JavaCompiler(GenericCompiler):
     def __init__(self, path="javac"):
         super(JavaCompiler, self).__init__(path)
 
-    def prepare_args(self, target):
-        args = self.JavaArgBuilder()
-        args.set_target(target.get_sources())
-        args.set_output_dir(target.output_dir)
-        dependencies = target.libraries
+    def call(self, args):
+        """
+        Runs javac on the compile server if it is enabled, see megazord.javaserver, or in a new process otherwise
+        """
+        if megazord.javaserver.enabled():
+            try:
+                return megazord.javaserver.call(self.path, args)
+            except megazord.javaserver.Unavailable as e:
+                megazord.system.warning("{}, falling back to {}".format(e, self.path))
+        return megazord.system.call(self.path, *args)
+
+    async def call_async(self, args, timeout=None):
+        """
+        Asynchronous counterpart of call()
+        """
+        if megazord.javaserver.enabled():
+            try:
+                return await megazord.javaserver.call_async(self.path, args, timeout)
+            except megazord.javaserver.Unavailable as e:
+                megazord.system.warning("{}, falling back to {}".format(e, self.path))
+        return await megazord.aio.call(self.path, *args, timeout=timeout)
+
+    def classpath(self, target):
+        dependencies = list(target.libraries)
         for dependency in target.dependencies:
             if dependency.output_format != '.jar':
                 raise ValueError("The only resolvable dependencies is .jar ones")
             dependencies.append(dependency.output_dir + dependency.output)
+        return dependencies
+
+    def prepare_args(self, target, sources=None):
+        """
+        :param sources: sources to compile, all sources of the target by default
+        """
+        args = self.JavaArgBuilder()
+        args.set_target(target.get_sources() if sources is None else sources)
+        args.set_output_dir(target.output_dir)
+        dependencies = self.classpath(target)
+        if sources is not None:
+            # Classes of not recompiled sources are taken from the output directory
+            dependencies.insert(0, target.output_dir)
+            args.append('-implicit:none')
         if len(dependencies) > 0:
             args.add_classpath(':'.join(dependencies))
         return args
+
+    def class_file(self, target, name):
+        return os.path.join(target.output_dir, name + '.class')
+
+    def plan_classes(self, target, full=False):
+        """
+        Finds sources which have to be recompiled: changed ones and ones referencing, directly or through other
+        recompiled sources, classes produced by changed or deleted sources. javac inlines compile-time constants
+        without references, so all sources are recompiled if a changed or deleted source has them. Removes class
+        files produced by recompiled sources.
+        :param full: recompile all sources
+        :return: list of sources to compile, the state of unchanged sources, digests of sources and supertypes of
+        classes of recompiled sources before recompilation
+        """
+        old_state = megazord.interstate.target_storage[target.name]['classes'] or {}
+        sources = target.get_sources()
+        digests = dict(zip(sources, megazord.utils.digests(sources)))
+        changed = set()
+        for source in sources:
+            state = old_state.get(source)
+            if state is None or state['hash'] != digests[source] or \
+                    not all(os.path.isfile(self.class_file(target, c)) for c in state['classes']):
+                changed.add(source)
+        # States saved by older versions don't tell whether sources have constants
+        if full or any(state.get('constants', True) for source, state in old_state.items()
+                       if source in changed or source not in digests):
+            changed = set(sources)
+        invalidated = set()
+        for source, state in old_state.items():
+            if source in changed or source not in digests:
+                invalidated.update(state['classes'])
+        while True:
+            dependents = [source for source, state in old_state.items() if source in digests and
+                          source not in changed and invalidated.intersection(state['references'])]
+            if not dependents:
+                break
+            for source in dependents:
+                changed.add(source)
+                invalidated.update(old_state[source]['classes'])
+        unchanged = {}
+        supertypes = {}
+        for source, state in old_state.items():
+            if source in changed or source not in digests:
+                supertypes.update(state.get('supertypes', {}))
+                for name in state['classes']:
+                    if os.path.isfile(self.class_file(target, name)):
+                        os.remove(self.class_file(target, name))
+            else:
+                unchanged[source] = state
+        if len(unchanged) != len(old_state):
+            megazord.interstate.target_storage[target.name]['classes'] = unchanged
+        return sorted(changed), unchanged, digests, supertypes
+
+    def classes_compiled(self, target, compiled, unchanged, digests, supertypes):
+        """
+        Reads class files produced by compiled sources and saves which classes every source produces and references
+        :param supertypes: supertypes of classes before recompilation, see plan_classes()
+        :return: True if supertypes of a recompiled class changed, so not recompiled classes may be stale
+        """
+        state = dict(unchanged)
+        for source in compiled:
+            state[source] = {'hash': digests[source], 'classes': [], 'references': [], 'supertypes': {},
+                             'constants': False}
+        known = set()
+        for source_state in unchanged.values():
+            known.update(source_state['classes'])
+        by_path = {}
+        for source in compiled:
+            by_path.setdefault(os.path.basename(source), []).append(source)
+        altered = False
+        for directory, _, files in os.walk(target.output_dir):
+            for f in files:
+                if not f.endswith('.class'):
+                    continue
+                path = os.path.join(directory, f)
+                name = os.path.relpath(path, target.output_dir)[:-len('.class')].replace(os.sep, '/')
+                if name in known:
+                    continue
+                try:
+                    info = megazord.classfile.parse(path)
+                except (ValueError, IndexError, struct.error):
+                    continue
+                candidates = by_path.get(info.source_file, [])
+                if len(candidates) > 1:
+                    package_dir = info.package().replace('/', os.sep)
+                    candidates = [c for c in candidates if os.path.dirname(c).endswith(package_dir)] or candidates
+                if candidates:
+                    source_state = state[candidates[0]]
+                    source_state['classes'].append(info.name)
+                    source_state['references'].extend(sorted(info.references))
+                    source_state['supertypes'][info.name] = info.supertypes
+                    source_state['constants'] = source_state['constants'] or info.constants
+                    if info.name in supertypes and supertypes[info.name] != info.supertypes:
+                        altered = True
+        megazord.interstate.target_storage[target.name]['classes'] = state
+        return altered
+
+    def compile(self, target):
+        if not target.incremental:
+            self.call(self.prepare_args(target).build())
+            return
+        sources, unchanged, digests, supertypes = self.plan_classes(target)
+        if len(sources) == 0:
+            megazord.system.info("All classes of {} loaded from cache".format(target.name))
+            return
+        self.call(self.prepare_args(target, sources).build())
+        if self.classes_compiled(target, sources, unchanged, digests, supertypes) and unchanged:
+            megazord.system.info("Supertypes changed in {}, recompiling all classes".format(target.name))
+            sources, unchanged, digests, supertypes = self.plan_classes(target, full=True)
+            self.call(self.prepare_args(target, sources).build())
+            self.classes_compiled(target, sources, unchanged, digests, supertypes)
+
+    async def compile_async(self, target, timeout=None):
+        if not target.incremental:
+            await self.call_async(self.prepare_args(target).build(), timeout)
+            return
+        # Hashing sources and parsing class files are kept off the event loop
+        sources, unchanged, digests, supertypes = await megazord.aio.blocking(self.plan_classes, target)
+        if len(sources) == 0:
+            megazord.system.info("All classes of {} loaded from cache".format(target.name))
+            return
+        await self.call_async(self.prepare_args(target, sources).build(), timeout)
+        altered = await megazord.aio.blocking(self.classes_compiled, target, sources, unchanged, digests, supertypes)
+        if altered and unchanged:
+            megazord.system.info("Supertypes changed in {}, recompiling all classes".format(target.name))
+            sources, unchanged, digests, supertypes = await megazord.aio.blocking(self.plan_classes, target, True)
+            await self.call_async(self.prepare_args(target, sources).build(), timeout)
+            await megazord.aio.blocking(self.classes_compiled, target, sources, unchanged, digests, supertypes)
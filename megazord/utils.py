@@ -1,10 +1,35 @@
+import os
+import re
+import mmap
+import time
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
 import megazord
 
+hash_algorithm = 'blake2b'
+mmap_threshold = 1024 * 1024
+
+
+def set_hash_algorithm(name):
+    """
+    Sets digest used for hashing of files (i.e 'blake2b', 'md5', 'sha1'). Changing it causes one full rebuild.
+    """
+    global hash_algorithm
+    hashlib.new(name)
+    hash_algorithm = name
+
 
 def filehash(filepath, hashfunc):
     hasher = hashfunc()
     blocksize = 64 * 1024
     with open(filepath, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        if size >= mmap_threshold:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+            return hasher.hexdigest()
         while True:
             data = fp.read(blocksize)
             if not data:
@@ -13,6 +38,164 @@ def filehash(filepath, hashfunc):
     return hasher.hexdigest()
 
 
+class FileHashCache:
+    """
+    Persistent cache of file digests keyed by (path, size, mtime, inode), stored in .megazord/filehashes
+    """
+    def __init__(self):
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.entries is None:
+                self.entries = megazord.interstate.load_object('filehashes') or {}
+            return self.entries
+
+    def save(self):
+        with self.lock:
+            if self.dirty:
+                megazord.interstate.save_object('filehashes', self.entries)
+                self.dirty = False
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.dirty = True
+
+    def digest(self, path):
+        return self.digests([path])[0]
+
+    def digests(self, paths, jobs=None):
+        """
+        :return: list of digests of files. Files missing in the cache are hashed concurrently.
+        """
+        entries = self.load()
+        result = [None] * len(paths)
+        misses = []
+        for i, path in enumerate(paths):
+            stat = os.stat(path)
+            key = (stat.st_size, stat.st_mtime_ns, stat.st_ino, hash_algorithm)
+            entry = entries.get(path)
+            if entry is not None and entry[0] == key:
+                result[i] = entry[1]
+            else:
+                misses.append((i, path, key))
+
+        def compute(miss):
+            return filehash(miss[1], lambda: hashlib.new(hash_algorithm))
+
+        if len(misses) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or min(32, (os.cpu_count() or 1) + 4)) as executor:
+                digests = list(executor.map(compute, misses))
+        else:
+            digests = list(map(compute, misses))
+        now = time.time_ns()
+        with self.lock:
+            for (i, path, key), digest in zip(misses, digests):
+                result[i] = digest
+                # File modified in the same second may be modified again without changing mtime
+                if now - key[1] > 1000000000:
+                    # Not entries: clear() might have replaced them meanwhile
+                    self.entries[path] = (key, digest)
+                    self.dirty = True
+        return result
+
+
+file_hash_cache = FileHashCache()
+
+
+def digest(path):
+    """
+    :return: cached digest of the file
+    """
+    return file_hash_cache.digest(path)
+
+
+def digests(paths):
+    """
+    :return: list of cached digests of the files
+    """
+    return file_hash_cache.digests(paths)
+
+
+def headers_hashes(headers):
+    existing = [header for header in headers if megazord.system.exists(header)]
+    existing_hashes = dict(zip(existing, digests(existing)))
+    hashes = []
+    for header in headers:
+        if header in existing_hashes:
+            hashes.append(existing_hashes[header])
+        else:
+            hashes.append('missing:{}'.format(header))
+    return hashes
+
+
+def symbols_hash(path):
+    """
+    :return: hash of dynamic symbols exported by the shared library or None if they can't be listed
+    """
+    if megazord.toolchain.which('nm') is None:
+        return None
+    try:
+        output = megazord.system.call('nm', '-D', '--defined-only', '--format=posix', path)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    symbols = []
+    for line in output.decode('utf-8', 'replace').splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        # Addresses move with any change of code, sizes are a part of the interface only for data
+        size = fields[3] if len(fields) > 3 and fields[1] not in 'TtWwi' else ''
+        symbols.append('{} {} {}'.format(fields[0], fields[1], size))
+    return reduce_hash(symbols, hashlib.md5)
+
+
+def parse_depfile(path):
+    """
+    :return: list of prerequisites from the Makefile-style depfile written by -MMD/-MF
+    """
+    if not megazord.system.exists(path):
+        return []
+    with open(path) as f:
+        return parse_depfile_content(f.read())
+
+
+def parse_depfile_content(content):
+    prerequisites = []
+    content = content.replace('\\\n', ' ')
+    for rule in content.splitlines():
+        if ':' not in rule:
+            continue
+        rule = rule.split(':', 1)[1]
+        for prerequisite in re.split(r'(?<!\\)\s+', rule.strip()):
+            if prerequisite:
+                prerequisites.append(prerequisite.replace('\\ ', ' '))
+    return unique_everseen(prerequisites)
+
+
+def write_if_changed(path, content):
+    """
+    Writes content to the file unless it already has it, so its mtime is kept
+    :return: True if the file was written
+    """
+    if os.path.isfile(path):
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
+
+
+def remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
 def reduce_hash(hashlist, hashfunc):
     hasher = hashfunc()
     for hashvalue in sorted(hashlist):
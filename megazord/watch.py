@@ -0,0 +1,272 @@
+"""
+Watch mode: targets are assembled once and then reassembled whenever their inputs change. The graph, resolved
+sources, compilers and hashes are kept in memory, so only targets whose sources or headers changed and their
+dependents are hashed and assembled again. Changes are received from inotify on Linux or found by polling.
+"""
+
+import os
+import glob
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import megazord
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+
+
+class InotifyMonitor:
+    """
+    Reports changes of files in watched directories through inotify
+    """
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def update(self, directories):
+        for directory in set(self.watches.values()) - set(directories):
+            wd = next(wd for wd, path in self.watches.items() if path == directory)
+            self.libc.inotify_rm_watch(self.fd, wd)
+            del self.watches[wd]
+        for directory in set(directories) - set(self.watches.values()):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = directory
+
+    def changes(self, timeout):
+        """
+        :return: set of changed paths, None if some changes were lost, empty set on timeout
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if wd in self.watches:
+                changed.add(os.path.join(self.watches[wd], os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingMonitor:
+    """
+    Finds changes of files in watched directories by comparing their stats every interval seconds
+    """
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.snapshots = {}
+
+    def snapshot(self, directory):
+        result = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                        result[entry.path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return result
+
+    def update(self, directories):
+        self.snapshots = {directory: self.snapshots.get(directory) or self.snapshot(directory)
+                          for directory in directories}
+
+    def changes(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for directory, old in self.snapshots.items():
+                new = self.snapshot(directory)
+                changed.update(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+                self.snapshots[directory] = new
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else max(min(self.interval, deadline - time.monotonic()), 0))
+
+    def close(self):
+        pass
+
+
+def monitor(polling=None, interval=1.0):
+    """
+    :param polling: True to poll, False to use inotify, None to use inotify if it is available
+    """
+    if not polling:
+        try:
+            return InotifyMonitor()
+        except (OSError, AttributeError):
+            if polling is False:
+                raise
+    return PollingMonitor(interval)
+
+
+class Watcher:
+    def __init__(self, targets, jobs=1, debounce=0.2, polling=None, interval=1.0):
+        """
+        :param targets: Target or list of root targets
+        :param jobs: number of targets assembled concurrently
+        :param debounce: changes are collected until there are none for this many seconds
+        :param polling: True to poll, False to use inotify, None to use inotify if it is available
+        :param interval: polling interval in seconds
+        """
+        self.roots = targets if isinstance(targets, list) else [targets]
+        self.jobs = jobs
+        self.debounce = debounce
+        self.monitor = monitor(polling, interval)
+        self.graph = []
+        self.dependents = {}
+        self.delayed = {}
+
+    def collect(self):
+        self.graph = []
+        self.dependents = {}
+        for root in self.roots:
+            order, _ = megazord.scheduler.collect(root)
+            for target in order:
+                if target not in self.dependents:
+                    self.graph.append(target)
+                    self.dependents[target] = []
+        for target in self.graph:
+            for dependency in set(target.dependencies):
+                self.dependents[dependency].append(target)
+
+    def inputs(self):
+        """
+        :return: dict {absolute path of an input: targets} and dict {watched directory: targets globbing it}
+        """
+        files = {}
+        directories = {}
+        for target in self.graph:
+            paths = list(target.sources) + target.get_headers()
+            if target.precompiled_header is not None:
+                paths.append(target.precompiled_header)
+            for path in paths:
+                files.setdefault(os.path.abspath(path), set()).add(target)
+            patterns = [target.sources_arg] if isinstance(target.sources_arg, str) else target.sources_arg
+            for pattern in patterns:
+                for directory in glob.glob(os.path.dirname(pattern) or '.'):
+                    directories.setdefault(os.path.abspath(directory), set()).add(target)
+        return files, directories
+
+    def build(self, affected=None):
+        """
+        Assemblies roots, keeping memoized hashes of targets not affected by changes
+        """
+        for target in self.graph if affected is None else affected:
+            target.hashes = {}
+        for root in self.roots:
+            try:
+                megazord.scheduler.Scheduler(self.jobs, keep_going=True).run(root, rehash=False)
+            except megazord.scheduler.BuildError as e:
+                megazord.system.warning(str(e))
+                for target, exc in e.failures.items():
+                    print("{}: {}".format(target.name, exc))
+
+    def wait(self):
+        """
+        Blocks until files change and there are no more changes for debounce seconds
+        :return: set of changed paths or None if it isn't known which paths changed
+        """
+        changed = self.monitor.changes(None)
+        while changed is not None:
+            more = self.monitor.changes(self.debounce)
+            if more is None:
+                return None
+            if not more:
+                return changed
+            changed.update(more)
+        return None
+
+    def affected(self, changed, files, directories):
+        """
+        :return: targets whose inputs changed or whose globs match other files now, and their dependents
+        """
+        if changed is None:
+            return set(self.graph)
+        direct = set()
+        for path in changed:
+            direct.update(files.get(path, ()))
+            for target in directories.get(os.path.dirname(path), ()):
+                old_sources = list(target.sources)
+                target.set_sources(target.sources_arg)
+                if target.sources != old_sources:
+                    direct.add(target)
+        result = set()
+        stack = list(direct)
+        while stack:
+            target = stack.pop()
+            if target not in result:
+                result.add(target)
+                stack.extend(self.dependents[target])
+        return result
+
+    def run(self, rebuilds=None):
+        """
+        Assemblies targets and reassembles them on changes until interrupted
+        :param rebuilds: stop after this many reassemblies, never by default
+        """
+        self.collect()
+        self.build()
+        # Sources, languages and compilers stay resolved, globs are expanded again on changes in their directories
+        for target in self.graph:
+            self.delayed[target] = target.delayed
+            target.delayed = False
+        try:
+            count = 0
+            while rebuilds is None or count < rebuilds:
+                files, directories = self.inputs()
+                self.monitor.update(sorted(set(os.path.dirname(path) for path in files) | set(directories)))
+                megazord.system.info("Watching {} files of {} targets".format(len(files), len(self.graph)))
+                affected = self.affected(self.wait(), files, directories)
+                if not affected:
+                    continue
+                megazord.system.info("Reassembling {}".format(', '.join(sorted(t.name for t in affected))))
+                self.build(affected)
+                count += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for target, delayed in self.delayed.items():
+                target.delayed = delayed
+            self.monitor.close()
+
+
+def watch(targets, jobs=1, debounce=0.2, polling=None, interval=1.0, rebuilds=None):
+    """
+    Assemblies targets and then reassembles targets affected by changes of files until interrupted
+    :param targets: Target or list of root targets
+    :param jobs: number of targets assembled concurrently
+    :param debounce: changes are collected until there are none for this many seconds
+    :param polling: True to poll, False to use inotify, None to use inotify if it is available
+    :param interval: polling interval in seconds
+    :param rebuilds: stop after this many reassemblies, never by default
+    """
+    Watcher(targets, jobs, debounce, polling, interval).run(rebuilds)